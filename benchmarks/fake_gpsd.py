@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# A scriptable stand-in for gpsd, for exercising the UART GPS driver without a receiver.
+# It speaks enough of the gpsd JSON protocol for GpsdClient: a VERSION banner on connect, then once
+# the client sends ?WATCH, a stream of TPV and SKY reports.
+# The reports come from a script of JSON lines, replayed in a loop, or are synthesized along a track.
+# drop_after closes every connection after that many reports, to exercise reconnection.
+#
+# Run from the repository root with e.g.:
+#   python3 benchmarks/fake_gpsd.py --port=2947 --rate_hz=1
+# and point the service at it with gpsd_host/gpsd_port.  It can also be used in-process, as
+# benchmarks/gpsd_benchmark.py does.
+
+import datetime
+import json
+import socketserver
+import threading
+import time
+
+from absl import app, flags
+
+VERSION = {'class': 'VERSION', 'release': '3.22', 'rev': '3.22', 'proto_major': 3, 'proto_minor': 14}
+
+
+# Reports along a straight track, one TPV and one SKY per step.
+def synthetic_reports(steps=60, latitude=47.6, longitude=-122.3):
+  reports = []
+  for step in range(steps):
+    timestamp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=step)
+    reports.append({'class': 'TPV', 'mode': 3, 'time': timestamp.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    'lat': latitude + step * 1e-5, 'lon': longitude + step * 1e-5, 'altMSL': 50.0,
+                    'speed': 1.1, 'track': 45.0, 'ept': 0.005})
+    reports.append({'class': 'SKY', 'hdop': 0.9,
+                    'satellites': [{'PRN': prn, 'used': prn < 8} for prn in range(12)]})
+  return reports
+
+
+def load_script(path):
+  with open(path) as script:
+    return [json.loads(line) for line in script if line.strip()]
+
+
+class FakeGpsd(object):
+  def __init__(self, reports=None, host='127.0.0.1', port=0, rate_hz=10, drop_after=None):
+    self.reports = reports or synthetic_reports()
+    self.period = 1 / rate_hz if rate_hz else 0
+    self.drop_after = drop_after
+    self.connections = 0
+    self.sent = 0
+    self.stop_event = threading.Event()
+
+    fake = self
+
+    class Handler(socketserver.StreamRequestHandler):
+      def handle(self):
+        fake.connections += 1
+        self.wfile.write(json.dumps(VERSION).encode('utf-8') + b'\n')
+        if not self.rfile.readline().startswith(b'?WATCH'):
+          return
+
+        count = 0
+        while not fake.stop_event.is_set():
+          report = fake.reports[count % len(fake.reports)]
+          try:
+            self.wfile.write(json.dumps(report).encode('utf-8') + b'\n')
+          except OSError:
+            return
+          count += 1
+          fake.sent += 1
+          if fake.drop_after and count >= fake.drop_after:
+            return
+          if fake.period:
+            time.sleep(fake.period)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+    self.server.daemon_threads = True
+    self.host, self.port = self.server.server_address
+    self.thread = None
+
+  def start(self):
+    self.thread = threading.Thread(target=self.server.serve_forever, name='FakeGpsd', daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.stop_event.set()
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    self.stop()
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('host', '127.0.0.1', 'Address to listen on.')
+flags.DEFINE_integer('port', 2947, 'Port to listen on.')
+flags.DEFINE_string('script', None, 'File of JSON reports, one per line, to replay in a loop.  Synthesized if unset.')
+flags.DEFINE_float('rate_hz', 2, 'Reports sent per second on each connection.')
+flags.DEFINE_integer('drop_after', None, 'Close each connection after this many reports.')
+
+
+def main(args):
+  reports = load_script(FLAGS.script) if FLAGS.script else None
+  with FakeGpsd(reports, FLAGS.host, FLAGS.port, FLAGS.rate_hz, FLAGS.drop_after) as fake:
+    print('Fake gpsd listening on {}:{}'.format(fake.host, fake.port))
+    try:
+      while True:
+        time.sleep(1)
+    except KeyboardInterrupt:
+      pass
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Measures the UART GPS driver's gpsd client against a fake gpsd:
+# how fast the stream is consumed, how long publish waits to read a fix, and how long the client
+# takes to come back after gpsd drops the connection.
+#
+# Run from the repository root with:
+#   python3 benchmarks/gpsd_benchmark.py
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from absl import app, flags
+
+from benchmarks.fake_gpsd import FakeGpsd
+from devices.gpsdclient import GpsdClient
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('reports', 20000, 'Reports streamed for the throughput measurement.')
+flags.DEFINE_integer('reads', 10000, 'Snapshot reads timed.')
+flags.DEFINE_integer('drops', 5, 'Dropped connections timed.')
+
+
+def wait_for(condition, timeout=30):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      raise Exception('Timed out')
+    time.sleep(0.001)
+
+
+def measure_throughput():
+  with FakeGpsd(rate_hz=0, drop_after=FLAGS.reports) as fake:
+    client = GpsdClient(fake.host, fake.port)
+    start = time.perf_counter()
+    with client:
+      wait_for(lambda: fake.sent >= FLAGS.reports and client.tpv is not None)
+    return FLAGS.reports / (time.perf_counter() - start)
+
+
+def measure_snapshot_reads():
+  with FakeGpsd(rate_hz=100) as fake:
+    with GpsdClient(fake.host, fake.port) as client:
+      wait_for(lambda: client.tpv is not None and client.sky is not None)
+      times = []
+      for _ in range(FLAGS.reads):
+        start = time.perf_counter()
+        # What publish does with the latest reports.
+        client.tpv.message, client.sky.message
+        times.append(time.perf_counter() - start)
+  return statistics.median(times)
+
+
+def measure_reconnect():
+  with FakeGpsd(rate_hz=100, drop_after=10) as fake:
+    with GpsdClient(fake.host, fake.port, min_backoff=0.1) as client:
+      times = []
+      for drop in range(FLAGS.drops):
+        wait_for(lambda: fake.connections > drop and client.connected)
+        start = time.perf_counter()
+        wait_for(lambda: fake.connections > drop + 1 and client.connected)
+        times.append(time.perf_counter() - start)
+  return statistics.median(times)
+
+
+def main(args):
+  print('Stream throughput:        {:10.0f} reports/s'.format(measure_throughput()))
+  print('Snapshot read in publish: {:10.2f} us'.format(measure_snapshot_reads() * 1e6))
+  print('Reconnect after a drop:   {:10.0f} ms (min_backoff 100 ms)'.format(measure_reconnect() * 1000))
+
+
+if __name__ == '__main__':
+  app.run(main)
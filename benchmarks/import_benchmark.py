@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Measures how long Python takes to import the service, and each driver and remote storage backend.
+# Every measurement is made in a fresh interpreter, so nothing is already cached in sys.modules.
+# "all drivers and backends" approximates the service before drivers were imported lazily.
+#
+# Run from the repository root with:
+#   python3 benchmarks/import_benchmark.py
+
+import os
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from absl import app, flags
+
+from devices.registry import DEVICE_DRIVERS
+from remotestorage.registry import REMOTE_STORAGE
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('runs', 5, 'Fresh interpreters started per measurement.')
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+  __import__(module)
+print(time.perf_counter() - start)
+"""
+
+
+# Returns the median import time in seconds, or the error if the modules cannot be imported here.
+def measure(modules):
+  times = []
+  for _ in range(FLAGS.runs):
+    result = subprocess.run([sys.executable, '-c', MEASURE_SCRIPT] + modules,
+                            cwd=REPOSITORY_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+      return None, result.stderr.decode('utf-8').strip().splitlines()[-1]
+    times.append(float(result.stdout))
+
+  return statistics.median(times), None
+
+
+def report(label, modules):
+  seconds, error = measure(modules)
+  if error:
+    print('  {:40s} unavailable ({})'.format(label, error))
+  else:
+    print('  {:40s} {:8.1f} ms'.format(label, seconds * 1000))
+
+
+def main(args):
+  driver_modules = sorted({path.split(':')[0] for path in DEVICE_DRIVERS.values()})
+  backend_modules = sorted({path.split(':')[0] for path in REMOTE_STORAGE.values()})
+
+  print('Median import time over {} runs:'.format(FLAGS.runs))
+  report('simpleaq', ['simpleaq'])
+  for module in driver_modules + backend_modules:
+    report(module, [module])
+  report('all drivers and backends', driver_modules + backend_modules)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Measures the memory used by the SimpleAQ data pipeline: readings written by a driver,
+# stored in SQLite, read back and serialized for upload.
+# Reports steady-state allocation per cycle, and the memory held by a batch of backlog rows.
+#
+# Run from the repository root with:
+#   python3 benchmarks/memory_benchmark.py
+
+import contextlib
+import datetime
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from absl import app, flags
+
+from devices.sensor import ReadingBatch, Sensor
+from localstorage import Reading
+from localstorage.localsqlite import LocalSqlite
+from timesources.synctimesource import SyncTimeSource
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('cycles', 500, 'Number of sampling cycles to measure.')
+flags.DEFINE_integer('fields', 30, 'Readings written per cycle.')
+flags.DEFINE_integer('upload_batch', 100, 'Rows read back and serialized per cycle, like max_backlog_writes.')
+flags.DEFINE_integer('backlog_rows', 10000, 'Rows in the simulated backlog.')
+
+
+class SyntheticSensor(Sensor):
+  def __init__(self, remotestorage, localstorage, timesource, fields, **kwargs):
+    super().__init__(remotestorage, localstorage, timesource, **kwargs)
+    self.name = "Synthetic"
+    self.fields = ['field_{}'.format(i) for i in range(fields)]
+
+  def publish(self):
+    batch = ReadingBatch('Synthetic')
+    for i, field in enumerate(self.fields):
+      batch.add(field, float(i))
+    return self._write_batch(batch)
+
+
+def rss_kib():
+  with open('/proc/self/status') as status:
+    for line in status:
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1])
+  return 0
+
+
+def run_cycle(sensor, local_storage, timesource):
+  timesource.set_time(datetime.datetime.now())
+  sensor.publish()
+  stored_readings = local_storage.getrecent(FLAGS.upload_batch)
+  "\n".join(reading.dumps() for reading in stored_readings.readings)
+  local_storage.deleterecords(stored_readings.ids)
+
+
+def measure_cycles(sensor, local_storage, timesource):
+  # Warm up caches, the SQLite page cache and the interpreter's free lists.
+  for _ in range(20):
+    run_cycle(sensor, local_storage, timesource)
+
+  gc.collect()
+  rss_before = rss_kib()
+  tracemalloc.start()
+  traced_before, _ = tracemalloc.get_traced_memory()
+
+  peaks = []
+  for _ in range(FLAGS.cycles):
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    run_cycle(sensor, local_storage, timesource)
+    peaks.append(tracemalloc.get_traced_memory()[1] - current)
+
+  gc.collect()
+  traced_after, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  rss_after = rss_kib()
+
+  print('Per cycle ({} readings written, up to {} uploaded):'.format(FLAGS.fields, FLAGS.upload_batch))
+  print('  peak allocation:     {:10.1f} KiB (mean), {:10.1f} KiB (max)'.format(sum(peaks) / len(peaks) / 1024, max(peaks) / 1024))
+  print('  traced growth:       {:10.1f} B/cycle over {} cycles'.format((traced_after - traced_before) / FLAGS.cycles, FLAGS.cycles))
+  print('  RSS:                 {:10d} KiB -> {} KiB'.format(rss_before, rss_after))
+
+
+def measure_backlog(local_storage, timesource):
+  timesource.set_time(datetime.datetime.now())
+  timestamp = timesource.get_time_ns()
+  local_storage.writereadings(
+      Reading('Synthetic', 'field_{}'.format(i % FLAGS.fields), value=float(i), time=timestamp)
+      for i in range(FLAGS.backlog_rows))
+
+  scale = 10000 / FLAGS.backlog_rows
+
+  gc.collect()
+  tracemalloc.start()
+  before, _ = tracemalloc.get_traced_memory()
+  stored_readings = local_storage.getrecent(FLAGS.backlog_rows)
+  held, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  print('Per 10k backlog rows ({} loaded):'.format(len(stored_readings)))
+  print('  held as readings:    {:10.1f} KiB (peak {:.1f} KiB)'.format((held - before) * scale / 1024, (peak - before) * scale / 1024))
+  del stored_readings
+
+  # For comparison, the previous representation: fetchall() row tuples plus a second list of their JSON strings.
+  gc.collect()
+  tracemalloc.start()
+  before, _ = tracemalloc.get_traced_memory()
+  with contextlib.closing(local_storage.db_conn.cursor()) as cursor:
+    cursor.execute("SELECT * FROM data ORDER BY id DESC LIMIT ?", (FLAGS.backlog_rows,))
+    rows = cursor.fetchall()
+    data_json = [row[1] for row in rows]
+  held, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  print('  held as row tuples:  {:10.1f} KiB (peak {:.1f} KiB)'.format((held - before) * scale / 1024, (peak - before) * scale / 1024))
+  del rows, data_json
+
+
+def main(args):
+  with tempfile.TemporaryDirectory() as directory:
+    with LocalSqlite(os.path.join(directory, 'benchmark.db')) as local_storage:
+      timesource = SyncTimeSource()
+      sensor = SyntheticSensor(None, local_storage, timesource, FLAGS.fields)
+
+      measure_cycles(sensor, local_storage, timesource)
+      measure_backlog(local_storage, timesource)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -1,55 +1,61 @@
 #!/usr/bin/env python3
 
 from absl import logging
-from . import Sensor
+from . import ReadingBatch, Sensor
+from .i2cbus import BusioAdapter
 
-import board
 import adafruit_bme680
 
 
+def read_bme680_sample(sensor):
+  """Returns temperature, gas, humidity and pressure from a single forced measurement."""
+  # Each property of the Adafruit driver triggers its own measurement unless one was taken
+  # within _min_refresh_time.  Take one measurement, then suppress refreshes while the
+  # compensated values are computed from it.
+  sensor._perform_reading()
+
+  min_refresh_time = sensor._min_refresh_time
+  sensor._min_refresh_time = float('inf')
+  try:
+    return sensor.temperature, sensor.gas, sensor.humidity, sensor.pressure
+  finally:
+    sensor._min_refresh_time = min_refresh_time
+
+
+FIELDS = ['temperature_C', 'voc_ohms', 'relative_humidity_pct', 'pressure_hPa']
+
+
 class Bme688(Sensor):
-  def __init__(self, remotestorage, localstorage, timesource, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
-    self.sensor = adafruit_bme680.Adafruit_BME680_I2C(board.I2C())
+  def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
+    super().__init__(remotestorage, localstorage, timesource, **kwargs)
+    self.i2c_transceiver = i2c_transceiver
+    self.i2c_address = 0x77
+    self.sensor = adafruit_bme680.Adafruit_BME680_I2C(BusioAdapter(i2c_transceiver), address=self.i2c_address)
     self.name = "BME688"
+    self._enable_oversampling(FIELDS)
+
+  def read_sample(self):
+    return dict(zip(FIELDS, read_bme680_sample(self.sensor)))
 
   def publish(self):
     logging.info('Publishing BME688 Data')
-    result = False
-    try:
-      # It is actually important that the try_write_to_remote happens before the result, otherwise
-      # it will never be evaluated!
-      result = self._try_write('BME688', 'temperature_C', self.sensor.temperature) or result
-    except Exception as err:
-      self._try_write_error('BME688', 'temperature_C', str(err))
-      logging.error("Error getting data from BME688.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
-      result = self.name 
+    batch = ReadingBatch('BME688')
 
     try:
-      # It is actually important that the try_write_to_remote happens before the result, otherwise
-      # it will never be evaluated!
-      result = self._try_write('BME688', 'voc_ohms', self.sensor.gas) or result
+      values = self.read_sample()
     except Exception as err:
-      self._try_write_error('BME688', 'voc_ohms', str(err))
+      for field in FIELDS:
+        batch.add_error(field, str(err))
       logging.error("Error getting data from BME688.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
-      result = self.name 
-
-    try:
-      # It is actually important that the try_write_to_remote happens before the result, otherwise
-      # it will never be evaluated!
-      result = self._try_write('BME688', 'relative_humidity_pct', self.sensor.humidity) or result
-    except Exception as err:
-      self._try_write_error('BME688', 'relative_humidity_pct', str(err))
-      logging.error("Error getting data from BME688.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
-      result = self.name 
-
-    try:
-      # It is actually important that the try_write_to_remote happens before the result, otherwise
-      # it will never be evaluated!
-      result = self._try_write('BME688', 'pressure_hPa', self.sensor.pressure) or result
-    except Exception as err:
-      self._try_write_error('BME688', 'pressure_hPa', str(err))
-      logging.error("Error getting data from BME688.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
-      result = self.name
-
-    return result
+      self._write_batch(batch)
+      return self.name
+
+    if self.oversampler:
+      # Include a reading taken right now along with those taken during the interval.
+      self.oversampler.add(values)
+      self._add_oversampled(batch)
+    else:
+      for field, value in values.items():
+        batch.add(field, value)
+
+    return self._write_batch(batch)
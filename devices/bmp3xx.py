@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
 from absl import logging
-from . import Sensor
+from . import ReadingBatch, Sensor
+from .i2cbus import BusioAdapter
 
-import board
 import adafruit_bmp3xx
 import time
 from adafruit_bmp3xx import _REGISTER_CONTROL, _REGISTER_STATUS, _REGISTER_PRESSUREDATA
@@ -63,39 +63,50 @@ def patch_bmp3xx_read(self):
 
   pressure = po1 + po2 + pd4
 
-  # pressure in hPa, temperature in deg C
+  # pressure in Pa, temperature in deg C
   return pressure, temperature
 
 
 class Bmp3xx(Sensor):
-  def __init__(self, remotestorage, localstorage, timesource, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
-    self.sensor = adafruit_bmp3xx.BMP3XX_I2C(board.I2C())
+  def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
+    super().__init__(remotestorage, localstorage, timesource, **kwargs)
+    self.i2c_transceiver = i2c_transceiver
+    self.i2c_address = 0x77
+    self.sensor = adafruit_bmp3xx.BMP3XX_I2C(BusioAdapter(i2c_transceiver), address=self.i2c_address)
 
     # We encounter an issue where bus instability causes an infinite loop in default
     # adafruit_bmp3xx read.
     self.sensor._read = MethodType(patch_bmp3xx_read, self.sensor)
     self.name = "BMP3XX"
+    self._enable_oversampling(['temperature_C', 'pressure_hPa'])
+
+  def read_sample(self):
+    # The temperature and pressure properties each run their own forced conversion through
+    # patch_bmp3xx_read.  Both values come out of one conversion, so do it once.
+    pressure, temperature = self.sensor._read()
+
+    # Compensated pressure is in Pa.
+    return {'temperature_C': temperature, 'pressure_hPa': pressure / 100}
 
   def publish(self):
     logging.info('Publishing BMP3XX Data')
-    result = False
-    try:
-      # It is actually important that the try_write_to_remote happens before the result, otherwise
-      # it will never be evaluated!
-      result = self._try_write('BMP3XX', 'temperature_C', self.sensor.temperature) or result
-    except Exception as err:
-      self._try_write_error('BMP3XX', 'temperature_C', str(err))
-      logging.error("Error getting data from BMP3XX.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
-      result = self.name 
+    batch = ReadingBatch('BMP3XX')
 
     try:
-      # It is actually important that the try_write_to_remote happens before the result, otherwise
-      # it will never be evaluated!
-      result = self._try_write('BMP3XX', 'pressure_hPa', self.sensor.pressure) or result
+      values = self.read_sample()
     except Exception as err:
-      self._try_write_error('BMP3XX', 'pressure_hPa', str(err))
+      batch.add_error('temperature_C', str(err))
+      batch.add_error('pressure_hPa', str(err))
       logging.error("Error getting data from BMP3XX.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
-      result = self.name
-
-    return result
+      self._write_batch(batch)
+      return self.name
+
+    if self.oversampler:
+      # Include a reading taken right now along with those taken during the interval.
+      self.oversampler.add(values)
+      self._add_oversampled(batch)
+    else:
+      for field, value in values.items():
+        batch.add(field, value)
+
+    return self._write_batch(batch)
@@ -0,0 +1,121 @@
+import collections
+import datetime
+import threading
+import time
+
+from absl import logging
+
+
+# Parses burst triggers of the form point/field:threshold:rate separated by semicolons, e.g.
+#   SEN5X/pm2.5_ug_m3:35:0.5;PCBArtistsDecibel/sound_level_dB:85:
+# A trigger fires when the value reaches the threshold, or when it changes faster than rate
+# units per second.  Either part may be left empty.
+def parse_burst_triggers(spec):
+  triggers = {}
+  for entry in (spec or '').split(';'):
+    entry = entry.strip()
+    if not entry:
+      continue
+
+    key, threshold, rate = (entry.split(':') + ['', ''])[:3]
+    point, field = key.split('/', 1)
+    triggers[(point, field)] = (
+        float(threshold) if threshold else None,
+        float(rate) if rate else None)
+
+  return triggers
+
+
+# Watches the values sensors write, and puts a sensor into burst sampling for a bounded window
+# when one of its watched fields fires a trigger.
+# The main loop publishes bursting sensors every `interval` seconds, as long as there is budget left
+# in the last hour, so a noisy trigger cannot flood storage or the upload.
+class BurstController(object):
+  def __init__(self, triggers, interval, duration, max_samples_per_hour):
+    self.triggers = triggers
+    self.interval = interval
+    self.duration = duration
+    self.max_samples_per_hour = max_samples_per_hour
+    self.last_values = {}
+    self.deadlines = {}
+    self.samples_taken = collections.deque()
+    # Sensors on different I2C buses write from different threads.
+    self.lock = threading.Lock()
+
+  def observe(self, sensor_name, point, field, value):
+    trigger = self.triggers.get((point, field))
+    if trigger is None or not isinstance(value, (int, float)):
+      return
+
+    with self.lock:
+      self._observe(sensor_name, point, field, value, trigger)
+
+  def _observe(self, sensor_name, point, field, value, trigger):
+    threshold, rate = trigger
+    now = time.monotonic()
+    last = self.last_values.get((point, field))
+    self.last_values[(point, field)] = (value, now)
+
+    fired = threshold is not None and value >= threshold
+    if not fired and rate is not None and last is not None and now > last[1]:
+      fired = abs(value - last[0]) / (now - last[1]) >= rate
+
+    # Bursts are not extended while active, so each one is bounded by duration.
+    if fired and not self._is_bursting(sensor_name):
+      logging.info("{}/{} reached {}, burst sampling {} for {}s.".format(point, field, value, sensor_name, self.duration))
+      self.deadlines[sensor_name] = now + self.duration
+
+  def is_bursting(self, sensor_name):
+    with self.lock:
+      return self._is_bursting(sensor_name)
+
+  def _is_bursting(self, sensor_name):
+    deadline = self.deadlines.get(sensor_name)
+    if deadline is None:
+      return False
+
+    if time.monotonic() >= deadline:
+      del self.deadlines[sensor_name]
+      return False
+
+    return True
+
+  # Consumes one burst sample from the hourly budget, if any is left.
+  def take_budget(self):
+    now = time.monotonic()
+    while self.samples_taken and now - self.samples_taken[0] > 3600:
+      self.samples_taken.popleft()
+
+    if len(self.samples_taken) >= self.max_samples_per_hour:
+      return False
+
+    self.samples_taken.append(now)
+    return True
+
+
+# Publish every sensor that is in a burst, as long as the burst budget allows.
+# These rows are tagged as burst samples and stamped with the current time rather than the cycle's.
+def publish_bursting_sensors(sensors, workers, timesource, burst_controller):
+  bursting_sensors = [sensor for sensor in sensors
+                      if burst_controller.is_bursting(sensor.name) and not (sensor.health and sensor.health.quarantined)]
+  if not bursting_sensors:
+    return
+
+  timesource.set_time(datetime.datetime.now())
+  budgeted_sensors = []
+  for sensor in bursting_sensors:
+    if not burst_controller.take_budget():
+      logging.warning("Burst sampling budget exhausted, skipping burst sample for {}.".format(sensor.name))
+      continue
+    budgeted_sensors.append(sensor)
+
+  workers.map(publish_burst_sample, budgeted_sensors)
+
+
+# Takes a sensor's burst sample, tagged as such.
+def publish_burst_sample(sensor):
+  sensor.bursting = True
+  try:
+    return sensor.publish_burst()
+  finally:
+    sensor.bursting = False
@@ -0,0 +1,76 @@
+import numbers
+import threading
+import time
+
+from absl import logging
+
+SECONDS_PER_DAY = 86400
+
+
+# Parses deadbands of the form point/field:tolerance separated by semicolons, e.g.
+#   BMP3XX/pressure_hPa:0.1;GPS/latitude_degrees:0.00001;GPS/last_known_gps_reading:0
+# A tolerance ending in % is relative to the last written value.
+def parse_deadbands(spec):
+  deadbands = {}
+  for entry in (spec or '').split(';'):
+    entry = entry.strip()
+    if not entry:
+      continue
+
+    key, tolerance = entry.rsplit(':', 1)
+    point, field = key.split('/', 1)
+    relative = tolerance.endswith('%')
+    deadbands[(point, field)] = (float(tolerance.rstrip('%')), relative)
+
+  return deadbands
+
+
+# Decides whether a value is worth storing.
+# A value within the deadband of the last value written for its field is dropped, unless that
+# field has been silent for `heartbeat` seconds.  Every stored value is therefore within tolerance
+# of the true value at every point in time, so the server can reconstruct the series.
+class DeadbandFilter(object):
+  def __init__(self, deadbands, heartbeat):
+    self.deadbands = deadbands
+    self.heartbeat = heartbeat
+    self.last_written = {}
+    self.rows_written = 0
+    self.rows_suppressed = 0
+    self.day_start = time.monotonic()
+    # Sensors on different I2C buses write from different threads.
+    self.lock = threading.Lock()
+
+  def should_write(self, point, field, value):
+    with self.lock:
+      deadband = self.deadbands.get((point, field))
+      # Only numbers can be within a tolerance.  Anything else, such as a missing value, is always written.
+      if deadband is None or not isinstance(value, numbers.Real):
+        self.rows_written += 1
+        return True
+
+      now = time.monotonic()
+      last = self.last_written.get((point, field))
+      if last is not None and now - last[1] < self.heartbeat:
+        tolerance, relative = deadband
+        limit = abs(last[0]) * tolerance / 100 if relative else tolerance
+        if abs(value - last[0]) <= limit:
+          self.rows_suppressed += 1
+          return False
+
+      self.last_written[(point, field)] = (value, now)
+      self.rows_written += 1
+      return True
+
+  # Returns (rows written, rows suppressed) once a day has passed since the last call, otherwise None.
+  def take_daily_counts(self):
+    with self.lock:
+      if time.monotonic() - self.day_start < SECONDS_PER_DAY:
+        return None
+
+      counts = (self.rows_written, self.rows_suppressed)
+      self.rows_written = 0
+      self.rows_suppressed = 0
+      self.day_start = time.monotonic()
+
+    logging.info("Deadband filtering wrote {} rows and suppressed {} rows in the last day.".format(*counts))
+    return counts
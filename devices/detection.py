@@ -0,0 +1,215 @@
+import concurrent.futures
+import json
+import os
+import queue
+import threading
+
+from absl import logging
+
+from .i2cbus import probe_address
+from .poller import Poller
+from .registry import DEVICE_DRIVERS
+
+# The I2C address each detectable device answers on.
+# Several devices share 0x77, so whichever of them is bound there owns the address.
+DEVICE_ADDRESSES = {
+    'bme688': 0x77,
+    'bmp3xx': 0x77,
+    'gps': 0x10,
+    'pm25': 0x12,
+    'sen5x': 0x69,
+    'dfrobotmultigas00': 0x74,
+    'dfrobotmultigas01': 0x75,
+    'dfrobotmultigas10': 0x76,
+    'dfrobotmultigas11': 0x77,
+    'pcbartistsdecibel': 0x48,
+}
+
+
+# Devices on the primary I2C bus are known by their name alone, which keeps detected_devices and the
+# detection cache the same as on a single-bus unit.  Devices on other buses are known as name@bus,
+# e.g. dfrobotmultigas00@i2c-3.
+def device_key(name, bus_label=None):
+  return '{}@{}'.format(name, bus_label) if bus_label else name
+
+
+# Returns (name, bus_label) for a device key.  The bus label is None for the primary bus.
+def split_device_key(key):
+  name, _, bus_label = key.partition('@')
+  return name, bus_label or None
+
+
+# Probes every known address once, and returns the set of addresses that answered.
+def sweep_addresses(transceiver):
+  return {address for address in sorted(set(DEVICE_ADDRESSES.values())) if probe_address(transceiver, address)}
+
+
+# Returns the devices that could be on the answering addresses, grouped by address.
+def candidate_groups(answering):
+  groups = {}
+  for name, address in DEVICE_ADDRESSES.items():
+    if address in answering:
+      groups.setdefault(address, []).append(name)
+  return list(groups.values())
+
+
+# Tries each group of candidate devices on its own thread, and returns the names of those that worked.
+# Candidates in a group share an address, so they are tried one at a time and the first that works owns it.
+def probe_candidates(groups, try_device):
+  def probe_group(names):
+    for name in names:
+      if try_device(name):
+        return name
+    return None
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(groups), 1)) as executor:
+    return {name for name in executor.map(probe_group, groups) if name}
+
+
+# Periodically probes the addresses of devices that are not running, and constructs sensors for any
+# that appear, so that a sensor can be added or reseated without restarting the service.
+# Constructing a sensor can take many seconds (the DFRobot probes retry for up to ten), so it happens
+# on the scanner's thread, and new sensors are handed to the main loop through a queue to be
+# attached between cycles.
+class HotplugScanner(object):
+  def __init__(self, transceiver, device_names, make_sensor, period):
+    self.transceiver = transceiver
+    self.make_sensor = make_sensor
+    self.bound = set(device_names)
+    self.rejected = set()
+    self.new_sensors = queue.Queue()
+    self.poller = Poller('HotplugScanner', self.scan, period)
+
+  def scan(self):
+    bound_addresses = {DEVICE_ADDRESSES[name] for name in self.bound if name in DEVICE_ADDRESSES}
+    answering = {}
+
+    for name, address in DEVICE_ADDRESSES.items():
+      if name in self.bound or address in bound_addresses:
+        continue
+
+      if address not in answering:
+        answering[address] = probe_address(self.transceiver, address)
+
+      if not answering[address]:
+        # Whatever was there is gone, so try again when something new answers.
+        self.rejected.discard(name)
+        continue
+
+      # Something answers here that we already know is not this device.
+      if name in self.rejected:
+        continue
+
+      try:
+        sensor = self.make_sensor(name)
+      except Exception as err:
+        logging.info("Device on 0x{:02X} is not a {}: {}".format(address, name, str(err)))
+        self.rejected.add(name)
+        continue
+
+      logging.info("Hot-plugged device: {}".format(name))
+      self.bound.add(name)
+      bound_addresses.add(address)
+      self.new_sensors.put((name, sensor))
+
+  # Returns (name, sensor) for every sensor constructed since the last call.
+  def take_new_sensors(self):
+    new_sensors = []
+    while True:
+      try:
+        new_sensors.append(self.new_sensors.get_nowait())
+      except queue.Empty:
+        return new_sensors
+
+  def __enter__(self):
+    self.poller.start()
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    self.poller.stop()
+
+
+# Loads the devices bound by the last run, as {name: fingerprint}, or None if there is no usable cache.
+def load_detection_cache(path):
+  if not path or not os.path.exists(path):
+    return None
+
+  try:
+    with open(path) as cache_file:
+      return json.load(cache_file)['devices']
+  except Exception as err:
+    logging.warning("Ignoring unreadable detection cache {}: {}".format(path, str(err)))
+    return None
+
+
+# Saves the fingerprint of every bound sensor, given as {name: sensor}.
+# The cache is replaced atomically, so that losing power mid-write leaves the old one intact.
+def save_detection_cache(path, sensors):
+  if not path:
+    return
+
+  try:
+    fingerprints = {name: sensor.fingerprint() for name, sensor in sensors.items()}
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as cache_file:
+      json.dump({'devices': fingerprints}, cache_file)
+    os.replace(temporary_path, path)
+  except Exception as err:
+    logging.error("Unable to save detection cache {}: {}".format(path, str(err)))
+
+
+def clear_detection_cache(path):
+  if path and os.path.exists(path):
+    os.remove(path)
+
+
+# Checks in the background that the devices bound from the cache on a warm boot are the ones installed.
+# A cached device whose address no longer answers, or whose fingerprint has changed, is a mismatch.
+# So is a device installed while the unit was off: try_device (as in detection) is tried on the
+# drivers not on I2C that are not bound and, unless hot-plugging will find them anyway, on
+# the devices that could be on addresses that answer but are not bound.
+# buses maps each bus label to its transceiver, and devices are keyed as by device_key.
+# mismatches is None until the check is done, and then a list of what did not match.
+class DetectionRevalidator(object):
+  def __init__(self, buses, cached_devices, sensors, try_device, hotplug=False):
+    self.buses = buses
+    self.cached_devices = cached_devices
+    self.sensors = dict(sensors)
+    self.try_device = try_device
+    self.hotplug = hotplug
+    self.mismatches = None
+    self.thread = threading.Thread(target=self._run, name='DetectionRevalidator', daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def _run(self):
+    mismatches = []
+    try:
+      answering = {bus_label: sweep_addresses(bus) for bus_label, bus in self.buses.items()}
+      for device, cached_fingerprint in self.cached_devices.items():
+        name, bus_label = split_device_key(device)
+        address = DEVICE_ADDRESSES.get(name)
+        if address is not None and address not in answering.get(bus_label, ()):
+          mismatches.append("{} no longer answers on 0x{:02X}".format(device, address))
+          continue
+
+        sensor = self.sensors.get(device)
+        fingerprint = sensor.fingerprint() if sensor else {}
+        for key, cached_value in cached_fingerprint.items():
+          # Values a driver could not read are not evidence either way.
+          if cached_value and fingerprint.get(key) and fingerprint[key] != cached_value:
+            mismatches.append("{} {} changed from {} to {}".format(device, key, cached_value, fingerprint[key]))
+
+      groups = [[name] for name in DEVICE_DRIVERS if name not in DEVICE_ADDRESSES and name not in self.sensors]
+      if not self.hotplug:
+        for bus_label, addresses in answering.items():
+          bound_addresses = {DEVICE_ADDRESSES.get(name) for name, label in map(split_device_key, self.sensors) if label == bus_label}
+          groups += [[device_key(name, bus_label) for name in group] for group in candidate_groups(addresses - bound_addresses)]
+
+      for device in sorted(probe_candidates(groups, self.try_device)):
+        mismatches.append("{} is installed but not bound".format(device))
+    except Exception as err:
+      mismatches.append("Revalidation failed: {}".format(str(err)))
+
+    self.mismatches = mismatches
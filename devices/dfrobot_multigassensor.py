@@ -4,13 +4,13 @@
 # https://github.com/DFRobot/DFRobot_MultiGasSensor/blob/main/python/raspberrypi/DFRobot_MultiGasSensor.py
 
 from absl import logging
-from . import Sensor
+from . import ReadingBatch, Sensor
+from .poller import Poller
 
+import collections
 import time
-import spidev
 import os
 import math
-import RPi.GPIO as GPIO
 
 I2C_MODE  = 0x01
 tempSwitch = 0
@@ -314,9 +314,10 @@ class DFRobot_MultiGasSensor(object):
     self.temp = self.__adc_to_temp(temp_ADC)
 
     # Perform temperature correction of the value if enabled.
-    Con = self.__temp_correction(self.gasconcentration)
+    self.uncorrectedgasconcentration = self.gasconcentration
+    self.gasconcentration = self.__temp_correction(self.gasconcentration)
+
 
-    
   def change_acquire_mode(self,mode):
     '''!
       @brief Change the mode of reporting data to the main controller after the sensor has collected the gas.
@@ -546,9 +547,10 @@ class DFRobot_MultiGasSensor_I2C(DFRobot_MultiGasSensor):
     self.__addr = addr
     super(DFRobot_MultiGasSensor_I2C, self).__init__(bus)
 
-  def data_is_available(self):
+  def data_is_available(self, read_delay=SEND_WAIT):
     '''
       * @brief Call this function in I2C active mode to determine the presence of data on data line
+      * @param read_delay Time to wait between the request and reading the frame
       * @return Whether data from sensor is available
       * @retval True  success is Available
       * @retval False  error is unavailable
@@ -564,7 +566,7 @@ class DFRobot_MultiGasSensor_I2C(DFRobot_MultiGasSensor):
     sendbuf[6]=0x00
     sendbuf[7]=0x00
     sendbuf[8]=fuc_check_sum(sendbuf,8)
-    recvbuf = self.transcieve(sendbuf, 9, SEND_WAIT)
+    recvbuf = self.transcieve(sendbuf, 9, read_delay)
     if (recvbuf[8] == fuc_check_sum(recvbuf, 8)):
       self.analysis_all_data(recvbuf)
       return True
@@ -581,16 +583,13 @@ class DFRobot_MultiGasSensor_I2C(DFRobot_MultiGasSensor):
     else:
       logging.error("Failed to write data to DFRobot MultiGas Sensor on {}: [{}] {}".format(self.__addr, status, error)) 
 
-      # Experimental method to recover from a stuck bus.
-      if status == self.i2cbus.STATUS_TIMEOUT or status == self.i2cbus.STATUS_UNSPECIFIED_ERROR:
-        logging.warn("It is likely that the I2C bus is stuck.")
-
+      # The bus manager recovers the bus itself after repeated timeouts.
       raise Exception(error)
 
 
 class DFRobotMultiGas(Sensor):
   def __init__(self, remotestorage, localstorage, timesource, bus, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
+    super().__init__(remotestorage, localstorage, timesource, **kwargs)
 
     # An additional kwarg, 'address', should be provided.
     # Each gas sensor on the bus must use a different DIP setting.
@@ -606,6 +605,19 @@ class DFRobotMultiGas(Sensor):
         kwargs['address'])
     
     self.address = kwargs['address']
+    self.i2c_transceiver = bus
+    self.i2c_address = self.address
+
+    # In PASSIVITY mode, every publish is a request-response round trip with long fixed waits.
+    # In INITIATIVE mode, the probe reports on its own and we drain it from a background thread
+    # into a small ring buffer, so that publish returns immediately.
+    self.streaming = os.getenv('dfrobot_acquire_mode', 'PASSIVITY').upper() == 'INITIATIVE'
+    self.stream_aggregate = os.getenv('dfrobot_stream_aggregate', 'mean').lower()
+    self.samples = collections.deque(maxlen=int(os.getenv('dfrobot_stream_buffer_size', '16')))
+    # A streaming probe already has its latest frame ready, so there is no need for the passive mode's long wait.
+    self.stream_read_delay = float(os.getenv('dfrobot_stream_read_delay_sec', '0.1'))
+    self.poller = None
+
     max_wait_time_sec = 10
     time_waited = 0
 
@@ -613,7 +625,7 @@ class DFRobotMultiGas(Sensor):
     change_success = False
     while not change_success and time_waited < max_wait_time_sec:
       try:
-        change_success = self.sensor.change_acquire_mode(self.sensor.PASSIVITY)
+        change_success = self.sensor.change_acquire_mode(self.sensor.INITIATIVE if self.streaming else self.sensor.PASSIVITY)
       except Exception as err:
         pass # Probably already logged.
       time_waited += 1
@@ -624,60 +636,134 @@ class DFRobotMultiGas(Sensor):
 
     self.sensor.set_temp_compensation(self.sensor.ON)
 
+    if self.streaming:
+      self.poller = Poller(
+          'DFRobotMultiGas{}'.format(self.dip),
+          self._poll_stream,
+          float(os.getenv('dfrobot_poll_interval_sec', '1')))
+
+  # The gas type is only known once the probe has reported at least once.
+  def fingerprint(self):
+    fingerprint = super().fingerprint()
+    fingerprint['gas_type'] = self.sensor.gastype
+    return fingerprint
+
+  def _poll_stream(self):
+    # A frame in INITIATIVE mode carries the concentration, the gas type and the temperature ADC,
+    # so one successful poll gives us a complete, self-consistent sample.
+    if self.sensor.data_is_available(self.stream_read_delay):
+      self.samples.append((self.sensor.uncorrectedgasconcentration, self.sensor.gasconcentration, self.sensor.temp))
+
+  # The newest streamed sample, left in the buffer so that it still counts towards the interval.
+  def _peek_stream(self):
+    try:
+      return self.samples[-1]
+    except IndexError:
+      raise Exception("No data available from multi-gas sensor on {}".format(self.address))
+
+  def _read_stream(self):
+    samples = []
+    while self.samples:
+      samples.append(self.samples.popleft())
+
+    # Nothing has streamed in since the last publish, such as during device detection
+    # when the poller is not running.  Poll once directly instead.
+    if not samples:
+      self._poll_stream()
+      while self.samples:
+        samples.append(self.samples.popleft())
+
+    if not samples:
+      raise Exception("No data available from multi-gas sensor on {}".format(self.address))
+
+    if self.stream_aggregate == 'latest':
+      return samples[-1]
+
+    aggregate = []
+    for values in zip(*samples):
+      values = [value for value in values if value is not None]
+      aggregate.append(sum(values) / len(values) if values else None)
+
+    return tuple(aggregate)
+
+  def _read_passive(self):
+    uncorrected_gas_concentration, gas_concentration = self.sensor.read_gas_concentration()
+    return uncorrected_gas_concentration, gas_concentration, self.sensor.temp
+
   def publish(self):
     logging.info('Publishing DFRobot Multi-Gas on I2C {} to.'.format(self.address))
+    return self._publish_reading(self._read_stream if self.streaming else self._read_passive)
+
+  # A passive read keeps nothing between publishes, but draining the stream would take the interval's samples.
+  def publish_burst(self):
+    if not self.streaming:
+      return self.publish()
+    return self._publish_reading(self._peek_stream)
+
+  def _publish_reading(self, read):
     result = False
+    batch = None
     try:
-      uncorrected_gas_concentration, gas_concentration = self.sensor.read_gas_concentration()
+      uncorrected_gas_concentration, gas_concentration, temperature = read()
+
       if self.sensor.gastype and self.sensor.gasunits:
+        batch = ReadingBatch('DFRobotMultiGas{}'.format(self.sensor.gastype))
+
         if uncorrected_gas_concentration is not None:
-          result = self._try_write('DFRobotMultiGas{}'.format(self.sensor.gastype), '{}_uncorrected_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), uncorrected_gas_concentration) or result
+          batch.add('{}_uncorrected_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), uncorrected_gas_concentration)
         else:
-          self._try_write_error('DFRobotMultiGas{}'.format(self.sensor.gastype), '{}_uncorrected_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), 'Failed to get uncorrected gas concentration.')
+          batch.add_error('{}_uncorrected_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), 'Failed to get uncorrected gas concentration.')
           result = self.name
           logging.warning("DFRobot Multi Gas {} failed to get uncorrected gas concentration!".format(self.sensor.gastype))
 
         if gas_concentration is not None:
-          result = self._try_write('DFRobotMultiGas{}'.format(self.sensor.gastype), '{}_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), gas_concentration) or result
+          batch.add('{}_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), gas_concentration)
         else:
-          self._try_write_error('DFRobotMultiGas{}'.format(self.sensor.gastype), '{}_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), 'Failed to get concentration.')
+          batch.add_error('{}_concentration_{}'.format(self.sensor.gastype, self.sensor.gasunits), 'Failed to get concentration.')
           result = self.name
           logging.warning("DFRobot Multi Gas {} failed to get gas concentration!".format(self.sensor.gastype))
 
-        try:
-          result = self._try_write('DFRobotMultiGas{}'.format(self.sensor.gastype), 'temperature_C', self.sensor.temp) or result
-        except Exception as err:
-          self._try_write_error('DFRobotMultiGas{}'.format(self.sensor.gastype), 'temperature_C'.format(self.sensor.gastype, self.sensor.gasunits), str(err))
-          result = self.name
-          logging.err("DFRobot Multi Gas {} failed to get temperature!".format(self.sensor.gastype))
+        batch.add('temperature_C', temperature)
       else:
         logging.error("Unable to determine gas type or units on DFRobotMultiGas{} sensor on {}".format(self.dip, self.address))
         result = self.name 
     except Exception as err:
       logging.error("Error getting data from DFRobotMultiGas{}.  Is this sensor correctly installed and the cable attached tightly: {}".format(self.dip, str(err)));
       result = self.name 
+
+    if batch is not None:
+      result = self._write_batch(batch) or result
+
     return result
 
+  def __enter__(self):
+    if self.poller:
+      self.poller.start()
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    if self.poller:
+      self.poller.stop()
+
 class DFRobotMultiGas00(DFRobotMultiGas):
   def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
     self.dip = "00"
     self.name = "DFRobotMultiGas00"
-    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x74))
+    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x74), **kwargs)
 
 class DFRobotMultiGas01(DFRobotMultiGas):
   def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
     self.dip = "01"
     self.name = "DFRobotMultiGas01"
-    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x75))
+    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x75), **kwargs)
 
 class DFRobotMultiGas10(DFRobotMultiGas):
   def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
     self.dip = "10"
     self.name = "DFRobotMultiGas10"
-    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x76))
+    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x76), **kwargs)
 
 class DFRobotMultiGas11(DFRobotMultiGas):
   def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
     self.dip = "11"
     self.name = "DFRobotMultiGas11"
-    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x77))
+    super().__init__(remotestorage, localstorage, timesource, bus=i2c_transceiver, address=int(0x77), **kwargs)
@@ -0,0 +1,100 @@
+import base64
+import json
+import subprocess
+import threading
+import time
+import zlib
+
+from absl import logging
+
+# Each command is bounded, so that no single one can take long on a Pi Zero: journalctl only reads
+# back as far as --since and stops after -n lines, instead of scanning the whole journal.
+# dmesg reads the kernel ring buffer, which is small, and is trimmed afterwards.
+def diagnostic_commands(lines, since_min):
+  def journal(unit):
+    return ['journalctl', '--no-pager', '--quiet', '-u', unit, '-n', str(lines), '--since', '-{}min'.format(since_min)]
+
+  return {
+      'dmesg': ['dmesg'],
+      'simpleaq': journal('simpleaq.service'),
+      'networkmanager': journal('NetworkManager'),
+      'hostap': journal('hostap_config.service'),
+  }
+
+
+# Runs a command without a shell and returns the last `lines` lines of its output, or why it failed.
+def run_bounded(command, lines, timeout):
+  try:
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    output = result.stdout.decode('utf-8', errors='replace')
+  except Exception as err:
+    return "{} failed: {}".format(command[0], str(err))
+  return '\n'.join(output.splitlines()[-lines:])
+
+
+# Packs diagnostics into a compact string for a single stored row: zlib-compressed JSON in base64.
+# Decode with json.loads(zlib.decompress(base64.b64decode(bundle[len('zlib+base64:'):]))).
+def encode_bundle(outputs):
+  return 'zlib+base64:' + base64.b64encode(zlib.compress(json.dumps(outputs).encode('utf-8'), 9)).decode('ascii')
+
+
+# Collects logs that help explain a failure, on a background thread, so that the main loop's
+# cycle timing is untouched however slow the commands are.
+# A collection runs at most once every min_interval_sec; requests in between are ignored, since the
+# last bundle already covers them.  The last bundle is kept, and is written again by the next
+# request if write_bundle failed.
+class DiagnosticsCollector(object):
+  def __init__(self, write_bundle, min_interval_sec=900, lines=100, since_min=60, timeout=10):
+    self.write_bundle = write_bundle
+    self.min_interval_sec = min_interval_sec
+    self.lines = lines
+    self.since_min = since_min
+    self.timeout = timeout
+    self.last_collected = None
+    self.bundle = None
+    self.pending = False
+    self.thread = None
+
+  # Starts a collection unless one is running or one ran recently.  Never blocks.
+  def request(self):
+    if self.thread is not None and self.thread.is_alive():
+      return False
+
+    if self.pending:
+      target = self._write
+    elif self.last_collected is None or time.monotonic() - self.last_collected >= self.min_interval_sec:
+      target = self._collect
+    else:
+      return False
+
+    self.thread = threading.Thread(target=target, name='DiagnosticsCollector', daemon=True)
+    self.thread.start()
+    return True
+
+  def _collect(self):
+    self.last_collected = time.monotonic()
+    start_time = time.monotonic()
+    outputs = {name: run_bounded(command, self.lines, self.timeout)
+               for name, command in diagnostic_commands(self.lines, self.since_min).items()}
+    self.bundle = encode_bundle(outputs)
+    logging.info("Collected {} bytes of diagnostics in {:.1f}s.".format(len(self.bundle), time.monotonic() - start_time))
+    self.pending = True
+    self._write()
+
+  # write_bundle returns a false value on success, like Sensor._write_batch.
+  def _write(self):
+    try:
+      failed = self.write_bundle(self.bundle)
+    except Exception as err:
+      logging.error("Failed to store diagnostics: {}".format(str(err)))
+      return
+
+    self.pending = bool(failed)
+
+  def __enter__(self):
+    return self
+
+  # Give a collection in progress a moment to finish, so that it is not lost when storage closes.
+  def __exit__(self, exception_type, exception_value, traceback):
+    if self.thread is not None:
+      self.thread.join(self.timeout)
@@ -1,39 +1,47 @@
 #!/usr/bin/env python3
 
 import calendar
+import collections
 import datetime
-import dotenv
 import os
 import time
 
 from absl import logging
-from . import Sensor
+from . import ReadingBatch, Sensor
+from .i2cbus import BusioAdapter
+from .poller import Poller
+from .tracksimplifier import GpsPositionMixin
 
-import board
 import adafruit_gps
 
+# Everything publish needs from the module, captured together so that it is self-consistent.
+GpsFix = collections.namedtuple('GpsFix', ['has_fix', 'fix_quality', 'timestamp_utc', 'latitude', 'longitude', 'altitude_m'])
 
-class Gps(Sensor):
-  def __init__(self, remotestorage, localstorage, timesource, interval=None, send_last_known_gps=False, env_file=None, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
+# The module emits about one sentence per type per second, so this is plenty to keep up.
+MAX_SENTENCES_PER_POLL = 8
+
+
+class Gps(GpsPositionMixin, Sensor):
+  def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, interval=None, send_last_known_gps=False, **kwargs):
+    super().__init__(remotestorage, localstorage, timesource, interval=interval, **kwargs)
+    self.i2c_transceiver = i2c_transceiver
+    self.i2c_address = 0x10
 
     self.name = "GPS"
     self.interval = interval
     self.has_set_time = False
-    # If available, we will save last known GPS coordinates to environment variables.
-    self.env_file = env_file
     self.send_last_known_gps = send_last_known_gps
 
-    # Seed last_latitude and last_longitude from the environment variable, if available.
-    self.latitude = float(os.getenv('last_latitude')) if os.getenv('last_latitude') else None
-    self.longitude = float(os.getenv('last_longitude')) if os.getenv('last_longitude') else None
+    # The last known position survives restarts, so it can be sent when there is no fix.
+    self._init_position()
 
     self.has_transmitted_device_info = False
 
     try:
-      self.gps = adafruit_gps.GPS_GtopI2C(board.I2C())
-      # Turn on everything the module collects.
-      self.gps.send_command(b"PMTK314,1,1,1,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0")
+      self.gps = adafruit_gps.GPS_GtopI2C(BusioAdapter(i2c_transceiver), address=self.i2c_address)
+      # Only RMC (time, position, fix) and GGA (altitude, fix quality) are used.  Every other sentence
+      # would have to be read over I2C and parsed just to be thrown away.
+      self.gps.send_command(b"PMTK314,0,1,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0")
       # Update once every second (1000ms)
       self.gps.send_command(b"PMTK220,1000")
     except Exception as err:
@@ -41,145 +49,120 @@ class Gps(Sensor):
       logging.error("Error setting up GPS.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
       raise err
 
+    # The module streams sentences whether or not we read them, so a background reader drains it
+    # continuously and publishes the latest fix as a snapshot.  Replacing the snapshot is a single
+    # reference assignment, so publish can read it without a lock.
+    self.snapshot = None
+    self.poller = Poller(self.name, self._poll_nmea, float(os.getenv('gps_poll_interval_sec', '0.5')))
+
+  def _poll_nmea(self):
+    updated = False
+    for _ in range(MAX_SENTENCES_PER_POLL):
+      if not self.gps.update():
+        break
+      updated = True
+
+    if updated or self.snapshot is None:
+      self.snapshot = GpsFix(self.gps.has_fix, self.gps.fix_quality, self.gps.timestamp_utc,
+                             self.gps.latitude, self.gps.longitude, self.gps.altitude_m)
+
+    fix = self.snapshot
+    if updated and fix.has_fix and fix.latitude and fix.longitude:
+      self._track_fix(fix.latitude, fix.longitude, fix.fix_quality or 1)
+
   # We automatically update the clock if the drift is greater than the reporting interval.
   # This will serve make sure that the device, no matter how long it's been powered down, reports a reasonably accurate time for measurements when possible.
   # We set the time at most once per run, assuming that the clock drift won't be significant compared to an incorrectly set system time.
   # Note that any change here will be quickly clobbered by NTP should any internet connection become available to the device. 
-  def _update_systime(self):
+  def _update_systime(self, timestamp_utc):
     if not self.has_set_time:
       if self.interval:
         epoch_seconds = None
         try:
-          epoch_seconds = calendar.timegm(self.gps.timestamp_utc)
+          epoch_seconds = calendar.timegm(timestamp_utc)
         except Exception as err:
           logging.warning("Error converting GPS timestamp: " + str(err))
           return
 
         if abs(time.time() - epoch_seconds) > self.interval:
-          logging.warning('Setting system clock to ' + datetime.datetime.fromtimestamp(calendar.timegm(self.gps.timestamp_utc)).isoformat() +
+          logging.warning('Setting system clock to ' + datetime.datetime.fromtimestamp(epoch_seconds).isoformat() +
                           ' because difference of ' + str(abs(time.time() - epoch_seconds)) +
                           ' exceeds interval time of ' + str(self.interval) + '.  This is error-prone and used only for the legacy I2C GPS.')
-          os.system('date --utc -s %s' % datetime.datetime.fromtimestamp(calendar.timegm(self.gps.timestamp_utc)).isoformat())
+          os.system('date --utc -s %s' % datetime.datetime.fromtimestamp(epoch_seconds).isoformat())
           os.system('hwclock --systohc')
           self.timesource.set_time(datetime.datetime.now())
           self.has_set_time = True
 
   def publish(self):
     logging.info('Publishing GPS data')
-    # Yes, recommended behavior is to call update twice.  
-    try:
-      self.gps.update()
-      self.gps.update()
-    except OSError as err:
-      logging.error('OSError when updating GPS: ' + str(err) + '.')
+    # The reader isn't running during device detection, so drain the module directly.
+    if self.poller.thread is None:
+      try:
+        self._poll_nmea()
+      except OSError as err:
+        logging.error('OSError when updating GPS: ' + str(err) + '.')
+
+    fix = self.snapshot
 
+    batch = ReadingBatch('GPS')
     result = False
+    track = []
     try:
       if not self.has_transmitted_device_info:
-        try:
-          result = self._try_write('GPS', 'Model', 'Adafruit Mini GPS PA1010D Stemma QT 1528-4415-ND')
-        except Exception as err:
-          self._try_write_error('GPS', 'Model', str(err))
-          result = self.name
-          raise err
-
-        self.has_transmitted_device_info = True
+        batch.add('Model', 'Adafruit Mini GPS PA1010D Stemma QT 1528-4415-ND')
 
-      if self.gps.has_fix:
-        if self.gps.timestamp_utc:
-          self._update_systime()
+      if fix is not None and fix.has_fix:
+        if fix.timestamp_utc:
+          self._update_systime(fix.timestamp_utc)
 
           # Sometimes the GPS timestamp is invalid.  In that case, don't write it.
           gps_timestamp = None
           try:
-            gps_timestamp = calendar.timegm(self.gps.timestamp_utc)
+            gps_timestamp = calendar.timegm(fix.timestamp_utc)
           except Exception as err:
             logging.warning("Error converting GPS timestamp: " + str(err))
 
           if gps_timestamp:
-            # It is actually important that the try_write_to_remote happens before the result, otherwise
-            # it will never be evaluated!
-            try:
-              result = self._try_write('GPS', 'timestamp_utc', gps_timestamp) or result
-            except Exception as err:
-              self._try_write_error('GPS', 'timestamp_utc', str(err))
-              result = self.name
-              raise err
+            batch.add('timestamp_utc', gps_timestamp)
 
         else:
           logging.warning('GPS has no timestamp data')
 
-        # Avoid flakes in case the reading changes.
-        gps_latitude = self.gps.latitude
-        gps_longitude = self.gps.longitude
-        gps_altitude = self.gps.altitude_m
+        gps_latitude = fix.latitude
+        gps_longitude = fix.longitude
+        gps_altitude = fix.altitude_m
 
         if gps_latitude and gps_longitude and abs(gps_latitude) <= 90 and abs(gps_longitude) <= 180:
-          # It is actually important that the try_write_to_remote happens before the result, otherwise
-          # it will never be evaluated!
-          self.latitude = gps_latitude
-          try:
-            result = self._try_write('GPS', 'latitude_degrees', self.latitude) or result
-          except Exception as err:
-            self._try_write_error('GPS', 'latitude_degrees', str(err))
-            result = self.name
-            raise err
-
-          self.longitude = gps_longitude
-          try:
-            result = self._try_write('GPS', 'longitude_degrees', self.longitude) or result
-          except Exception as err:
-            self._try_write_error('GPS', 'longitude_degrees', str(err))
-            result = self.name
-            raise err
+          track = self._add_position(batch, gps_latitude, gps_longitude)
 
           if gps_altitude is not None:
-            try:
-              result = self._try_write('GPS', 'altitude_m', gps_altitude) or result
-            except Exception as err:
-              self._try_write_error('GPS', 'altitude_m', str(err))
-              result = self.name
-              raise err
+            batch.add('altitude_m', gps_altitude)
+
+          if fix.fix_quality is not None:
+            batch.add('fix_quality', fix.fix_quality)
 
           if self.send_last_known_gps:
-            try:
-              result = self._try_write('GPS', 'last_known_gps_reading', 0) or result
-            except Exception as err:
-              self._try_write_error('GPS', 'last_known_gps_reading', str(err))
-              result = self.name
-              raise err
-
-
-          # Save the last-known latitude and longitude if they're available.
-          if self.env_file:
-            dotenv.set_key(
-                self.env_file,
-                'last_latitude',
-                str(self.latitude))
-            dotenv.set_key(
-                self.env_file,
-                'last_longitude',
-                str(self.longitude))
+            batch.add('last_known_gps_reading', 0)
         else:
-          if self.send_last_known_gps:
-            # If desired, send the last-known GPS values.
-            if self.latitude is not None and self.longitude is not None:
-              result = self._try_write('GPS', 'latitude_degrees', self.latitude) or result
-              result = self._try_write('GPS', 'longitude_degrees', self.longitude) or result
-              result = self._try_write('GPS', 'last_known_gps_reading', 1) or result
-
+          track = self._add_lost_position(batch)
           logging.warning('GPS has no lat/lon data.')
       else:
-        if self.send_last_known_gps:
-          # If desired, send the last-known GPS values.
-          if self.latitude is not None and self.longitude is not None:
-            result = self._try_write('GPS', 'latitude_degrees', self.latitude) or result
-            result = self._try_write('GPS', 'longitude_degrees', self.longitude) or result
-            result = self._try_write('GPS', 'last_known_gps_reading', 1) or result
-
-        logging.warning('GPS has no fix (quality: {})'.format(self.gps.fix_quality))
+        track = self._add_lost_position(batch)
+        logging.warning('GPS has no fix (quality: {})'.format(fix.fix_quality if fix else None))
     except Exception as err:
       logging.error("Error getting data from GPS.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
       result = self.name
 
+    result = self._write_batch(batch) or result
+    result = self._write_track(track) or result
+    if not result:
+      self.has_transmitted_device_info = True
+
     return result
+
+  def __enter__(self):
+    self.poller.start()
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    self.poller.stop()
+    self._close_position()
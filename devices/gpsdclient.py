@@ -0,0 +1,129 @@
+import json
+import socket
+import threading
+import time
+
+from absl import logging
+
+WATCH_COMMAND = b'?WATCH={"enable":true,"json":true};\n'
+
+# Long enough for gpsd to answer, short enough that stop() is noticed promptly.
+SOCKET_TIMEOUT_SEC = 1
+
+
+# The latest report of one gpsd message class, and when we received it.
+class GpsdReport(object):
+  __slots__ = ('message', 'received')
+
+  def __init__(self, message, received):
+    self.message = message
+    self.received = received
+
+  def age(self):
+    return time.monotonic() - self.received
+
+
+# Keeps a WATCH stream open to gpsd on a background thread, and holds the latest TPV (time, position,
+# velocity) and SKY (satellites, dilution of precision) reports.
+# Reports are replaced whole, never modified, so readers need no lock.  If gpsd goes away, the client
+# reconnects with exponential backoff.
+class GpsdClient(object):
+  def __init__(self, host='127.0.0.1', port=2947, min_backoff=1, max_backoff=60):
+    self.host = host
+    self.port = port
+    self.min_backoff = min_backoff
+    self.max_backoff = max_backoff
+    self.tpv = None
+    self.sky = None
+    self.connected = False
+    self.reconnects = 0
+    # Called on the client's thread with each TPV report, for consumers that need every fix.
+    self.on_tpv = None
+    self.stop_event = threading.Event()
+    self.thread = None
+
+  # Checks that gpsd is listening, by connecting and waiting for its VERSION banner.
+  def check(self):
+    with socket.create_connection((self.host, self.port), timeout=SOCKET_TIMEOUT_SEC * 5) as connection:
+      banner = json.loads(connection.makefile('rb').readline())
+      if banner.get('class') != 'VERSION':
+        raise Exception("Unexpected banner from gpsd: {}".format(banner))
+      return banner
+
+  def start(self):
+    if self.thread is not None:
+      return
+
+    self.stop_event.clear()
+    self.thread = threading.Thread(target=self._run, name='GpsdClient', daemon=True)
+    self.thread.start()
+
+  def stop(self, timeout=None):
+    self.stop_event.set()
+    if self.thread is not None:
+      self.thread.join(timeout)
+      self.thread = None
+
+  def _run(self):
+    backoff = self.min_backoff
+    while not self.stop_event.is_set():
+      try:
+        with socket.create_connection((self.host, self.port), timeout=SOCKET_TIMEOUT_SEC) as connection:
+          connection.sendall(WATCH_COMMAND)
+          self.connected = True
+          logging.info("Streaming from gpsd on {}:{}.".format(self.host, self.port))
+
+          for line in self._lines(connection):
+            self._handle(line)
+            backoff = self.min_backoff
+      except Exception as err:
+        logging.warning("Lost connection to gpsd: {}".format(str(err)))
+
+      self.connected = False
+      if self.stop_event.wait(backoff):
+        return
+
+      backoff = min(backoff * 2, self.max_backoff)
+      self.reconnects += 1
+
+  # Yields complete lines until the connection closes or we are stopped.
+  def _lines(self, connection):
+    buffer = b''
+    while not self.stop_event.is_set():
+      try:
+        data = connection.recv(4096)
+      except socket.timeout:
+        continue
+
+      if not data:
+        raise Exception("gpsd closed the connection")
+
+      buffer += data
+      while b'\n' in buffer:
+        line, buffer = buffer.split(b'\n', 1)
+        yield line
+
+  def _handle(self, line):
+    try:
+      message = json.loads(line)
+    except ValueError:
+      return
+
+    message_class = message.get('class')
+    if message_class == 'TPV':
+      self.tpv = GpsdReport(message, time.monotonic())
+      if self.on_tpv:
+        self.on_tpv(self.tpv)
+    elif message_class == 'SKY':
+      # Older gpsd versions report only the satellite list, newer ones also count them.
+      satellites = message.get('satellites') or []
+      message.setdefault('nSat', len(satellites))
+      message.setdefault('uSat', sum(1 for satellite in satellites if satellite.get('used')))
+      self.sky = GpsdReport(message, time.monotonic())
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    self.stop()
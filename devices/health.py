@@ -0,0 +1,77 @@
+import time
+
+from absl import logging
+
+
+# Tracks consecutive failures of one sensor.
+# After failure_threshold failures in a row the sensor is quarantined, and is not polled until the
+# quarantine expires.  Each failure while quarantined doubles the quarantine, up to max_backoff,
+# so an unplugged device costs almost nothing while a flaky one still gets retried.
+class SensorHealth(object):
+  def __init__(self, name, failure_threshold, base_backoff, max_backoff):
+    self.name = name
+    self.failure_threshold = failure_threshold
+    self.base_backoff = base_backoff
+    self.max_backoff = max_backoff
+    self.consecutive_failures = 0
+    self.backoff = base_backoff
+    self.quarantined_until = None
+
+  @property
+  def quarantined(self):
+    return self.quarantined_until is not None
+
+  def is_due(self):
+    return self.quarantined_until is None or time.monotonic() >= self.quarantined_until
+
+  def record_success(self):
+    if self.quarantined:
+      logging.info("{} is healthy again and has been reinstated.".format(self.name))
+
+    self.consecutive_failures = 0
+    self.backoff = self.base_backoff
+    self.quarantined_until = None
+
+  def record_failure(self):
+    self.consecutive_failures += 1
+    if self.consecutive_failures < self.failure_threshold:
+      return
+
+    if self.quarantined:
+      self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    logging.warning("{} failed {} times in a row and is quarantined for {}s.".format(self.name, self.consecutive_failures, self.backoff))
+    self.quarantined_until = time.monotonic() + self.backoff
+
+
+# Publishes a sensor unless it is quarantined, and records how it went.
+# Returns what publish returns, or False if the sensor was skipped.
+def publish_with_health(sensor):
+  health = sensor.health
+  if health is None:
+    return sensor.publish()
+
+  if not health.is_due():
+    return False
+
+  # Before reinstating a quarantined sensor, make sure the device answers at all.
+  # A full publish of a missing device can block for seconds.
+  if health.quarantined and not sensor.probe():
+    health.record_failure()
+    return False
+
+  was_quarantined = health.quarantined
+  result = sensor.publish()
+  if result:
+    health.record_failure()
+  else:
+    health.record_success()
+
+  # A sensor's background polling stops while it is quarantined, so that it does not keep the bus
+  # busy with a device that is not answering.  Drivers read directly while it is stopped.
+  if health.quarantined and not was_quarantined:
+    sensor.pause()
+  elif was_quarantined and not health.quarantined:
+    sensor.resume()
+
+  return result
@@ -0,0 +1,278 @@
+import errno
+import shutil
+import subprocess
+import threading
+import time
+
+from absl import logging
+
+# Bits on the wire per byte: eight data bits and an acknowledge.
+BITS_PER_BYTE = 9
+
+# Half a clock period while bit-banging recovery.  Python cannot sleep for 5us, so this is slower
+# than 100 kHz, which every device tolerates.
+RECOVERY_HALF_PERIOD_SEC = 0.00001
+
+# Don't keep recovering a bus that recovery does not help.
+RECOVERY_HOLDOFF_SEC = 10
+
+
+# The bus manager all drivers go through.
+# Wraps the LinuxI2cTransceiver so that every transaction is serialized.  Some drivers poll the bus
+# from a background thread, and a transaction is several syscalls (select address, then write or read),
+# so unsynchronized access would interleave them.
+# Every transaction is counted, along with how long it held the bus and how long it waited for it,
+# so that utilization and contention can be reported and sampling scheduled around them.
+# After recovery_threshold consecutive timeouts, the bus is assumed stuck (usually a device holding SDA
+# low after a transaction was interrupted) and is recovered in place, given the SCL and SDA GPIO pins.
+# Anything not overridden here is passed through to the underlying transceiver, so this can be
+# used anywhere a LinuxI2cTransceiver is expected, including a sensirion I2cConnection.
+class I2cBus(object):
+  def __init__(self, transceiver, clock_hz=100000, scl_pin=None, sda_pin=None, recovery_threshold=3):
+    self.transceiver = transceiver
+    self.clock_hz = clock_hz
+    self.scl_pin = scl_pin
+    self.sda_pin = sda_pin
+    self.recovery_threshold = recovery_threshold
+    self.consecutive_timeouts = 0
+    self.last_recovery = None
+    # Set when recovery could not free the bus, and the device needs to be power cycled.
+    self.stuck = False
+    self.lock = threading.RLock()
+    self.statistics_lock = threading.Lock()
+    self._reset_statistics()
+
+  def _reset_statistics(self):
+    self.statistics_start = time.monotonic()
+    self.transactions = 0
+    self.bytes_transferred = 0
+    self.errors = 0
+    self.busy_sec = 0.0
+    self.wait_sec = 0.0
+    self.recoveries = 0
+
+  def acquire(self, timeout=-1):
+    start_time = time.monotonic()
+    acquired = self.lock.acquire(timeout=timeout)
+    with self.statistics_lock:
+      self.wait_sec += time.monotonic() - start_time
+    return acquired
+
+  def release(self):
+    self.lock.release()
+
+  # Linux has no repeated start, so a write followed by a read is two transactions anyway.  They are
+  # made separately here, and the bus is free for other devices while this one prepares its response,
+  # rather than held idle for read_delay.
+  def transceive(self, slave_address, tx_data, rx_length, read_delay, timeout):
+    if not (tx_data and rx_length and read_delay):
+      return self._transceive(slave_address, tx_data, rx_length, read_delay, timeout)
+
+    status, error, _ = self._transceive(slave_address, tx_data, None, 0, timeout)
+    if status != self.transceiver.STATUS_OK:
+      return status, error, None
+
+    time.sleep(read_delay)
+    return self._transceive(slave_address, None, rx_length, 0, timeout)
+
+  def _transceive(self, slave_address, tx_data, rx_length, read_delay, timeout):
+    self.acquire()
+    try:
+      start_time = time.monotonic()
+      status, error, rx_data = self.transceiver.transceive(slave_address, tx_data, rx_length, read_delay, timeout)
+      busy_sec = time.monotonic() - start_time
+    finally:
+      self.release()
+
+    with self.statistics_lock:
+      self.transactions += 1
+      self.bytes_transferred += len(tx_data or b'') + len(rx_data or b'')
+      self.busy_sec += busy_sec
+      if status != self.transceiver.STATUS_OK:
+        self.errors += 1
+
+    # The Linux transceiver reports every failure as unspecified, so timeouts are told apart by errno.
+    # A missing device NACKs instead, which says nothing about the bus.
+    if status == self.transceiver.STATUS_TIMEOUT or getattr(error, 'errno', None) == errno.ETIMEDOUT:
+      self.consecutive_timeouts += 1
+      if self.consecutive_timeouts >= self.recovery_threshold:
+        self.recover()
+    elif status == self.transceiver.STATUS_OK:
+      self.consecutive_timeouts = 0
+      self.stuck = False
+
+    return status, error, rx_data
+
+  # Frees a stuck bus: clocks SCL until the device holding SDA lets go, generates a STOP,
+  # hands the pins back to the I2C controller and reopens the transceiver.
+  # Returns whether SDA was released.
+  def recover(self):
+    if self.scl_pin is None or self.sda_pin is None:
+      return False
+
+    if self.last_recovery is not None and time.monotonic() - self.last_recovery < RECOVERY_HOLDOFF_SEC:
+      return False
+
+    with self.lock:
+      logging.warning("{} consecutive I2C timeouts, attempting bus recovery.".format(self.consecutive_timeouts))
+      self.last_recovery = time.monotonic()
+      self.consecutive_timeouts = 0
+
+      self.transceiver.close()
+      try:
+        released = self._clock_out_and_stop()
+      except Exception as err:
+        logging.error("I2C bus recovery failed: {}".format(str(err)))
+        released = False
+      finally:
+        self._restore_alternate_function()
+        self.transceiver.open()
+
+    with self.statistics_lock:
+      self.recoveries += 1
+
+    self.stuck = not released
+    if released:
+      logging.info("I2C bus recovered.")
+    else:
+      logging.error("I2C bus recovery could not release SDA.  The device should be power cycled.")
+    return released
+
+  # Bit-bangs the bus as open drain: a line is pulled low by driving it, and released by making it an input.
+  def _clock_out_and_stop(self):
+    # Imported here because it is only available on a Pi, and only needed when the bus is stuck.
+    import RPi.GPIO as GPIO
+
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    try:
+      GPIO.setup(self.sda_pin, GPIO.IN)
+      GPIO.setup(self.scl_pin, GPIO.IN)
+
+      # A device holding SDA low is part way through sending a byte.  At most nine clocks finish it.
+      for _ in range(9):
+        if GPIO.input(self.sda_pin):
+          break
+        GPIO.setup(self.scl_pin, GPIO.OUT, initial=GPIO.LOW)
+        time.sleep(RECOVERY_HALF_PERIOD_SEC)
+        GPIO.setup(self.scl_pin, GPIO.IN)
+        time.sleep(RECOVERY_HALF_PERIOD_SEC)
+
+      released = bool(GPIO.input(self.sda_pin))
+      if released:
+        # STOP: SDA rises while SCL is high.
+        GPIO.setup(self.scl_pin, GPIO.OUT, initial=GPIO.LOW)
+        GPIO.setup(self.sda_pin, GPIO.OUT, initial=GPIO.LOW)
+        time.sleep(RECOVERY_HALF_PERIOD_SEC)
+        GPIO.setup(self.scl_pin, GPIO.IN)
+        time.sleep(RECOVERY_HALF_PERIOD_SEC)
+        GPIO.setup(self.sda_pin, GPIO.IN)
+        time.sleep(RECOVERY_HALF_PERIOD_SEC)
+
+      return released
+    finally:
+      GPIO.cleanup([self.scl_pin, self.sda_pin])
+
+  # RPi.GPIO cannot select alternate functions, so the pins go back to the I2C controller (ALT0)
+  # with whichever pin tool this OS release has.
+  def _restore_alternate_function(self):
+    for tool in ['pinctrl', 'raspi-gpio']:
+      if shutil.which(tool):
+        for pin in [self.scl_pin, self.sda_pin]:
+          subprocess.run([tool, 'set', str(pin), 'a0'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+        return
+
+    logging.error("Neither pinctrl nor raspi-gpio is installed, so the I2C pins cannot be restored.")
+
+  # Returns the bus statistics since the last call, and starts counting again.
+  # Wire time is estimated from the clock, while busy time is how long the bus was held, including
+  # the waits some devices need between writing a command and reading the result.
+  def take_statistics(self):
+    with self.statistics_lock:
+      elapsed = max(time.monotonic() - self.statistics_start, 1e-9)
+      statistics = {
+          'i2c_transactions': self.transactions,
+          'i2c_bytes': self.bytes_transferred,
+          'i2c_errors': self.errors,
+          'i2c_wire_sec': (self.bytes_transferred + self.transactions) * BITS_PER_BYTE / self.clock_hz,
+          'i2c_busy_sec': self.busy_sec,
+          'i2c_lock_wait_sec': self.wait_sec,
+          'i2c_utilization_pct': 100 * self.busy_sec / elapsed,
+          'i2c_recoveries': self.recoveries,
+      }
+      self._reset_statistics()
+    return statistics
+
+  def __getattr__(self, name):
+    return getattr(self.transceiver, name)
+
+
+# On a Raspberry Pi the I2C clock is fixed at boot by dtparam=i2c_arm_baudrate, so the configured
+# clock cannot be applied at runtime.  This warns if the two disagree, since the accounting would be off.
+def check_clock(bus_device, clock_hz):
+  path = '/sys/class/i2c-adapter/{}/of_node/clock-frequency'.format(bus_device.split('/')[-1])
+  try:
+    with open(path, 'rb') as clock_file:
+      adapter_clock_hz = int.from_bytes(clock_file.read(4), 'big')
+  except OSError:
+    return
+
+  if adapter_clock_hz != clock_hz:
+    logging.warning("{} runs at {} Hz, but i2c_clock_hz is {}.  Set dtparam=i2c_arm_baudrate={} in /boot/config.txt to change it.".format(
+        bus_device, adapter_clock_hz, clock_hz, clock_hz))
+
+
+# Presents an I2cBus as a busio.I2C, so that the Adafruit drivers share the bus manager instead of
+# opening the bus again through board.I2C().
+# A driver holds the lock from try_lock to unlock, so its multi-transaction sequences are not interleaved.
+class BusioAdapter(object):
+  def __init__(self, bus):
+    self.bus = bus
+
+  def try_lock(self):
+    # Blocking here is better than letting adafruit_bus_device spin on us.
+    return self.bus.acquire(timeout=1)
+
+  def unlock(self):
+    self.bus.release()
+
+  def scan(self):
+    return [address for address in range(0x08, 0x78) if probe_address(self.bus, address)]
+
+  def _transceive(self, address, tx_data, rx_length):
+    status, error, rx_data = self.bus.transceive(address, tx_data, rx_length, read_delay=0, timeout=1)
+    if status != self.bus.STATUS_OK:
+      if isinstance(error, OSError):
+        raise error
+      raise OSError("I2C transaction with 0x{:02X} failed with status {}: {}".format(address, status, error))
+    return rx_data
+
+  def writeto(self, address, buffer, *, start=0, end=None):
+    self._transceive(address, bytes(buffer[start:end]), None)
+
+  def readfrom_into(self, address, buffer, *, start=0, end=None):
+    end = len(buffer) if end is None else end
+    buffer[start:end] = self._transceive(address, None, end - start)
+
+  def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+    in_end = len(buffer_in) if in_end is None else in_end
+    buffer_in[in_start:in_end] = self._transceive(address, bytes(buffer_out[out_start:out_end]), in_end - in_start)
+
+  def deinit(self):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    pass
+
+
+# Checks whether anything acknowledges its address with a zero-byte write, without touching
+# any of its registers.  This is the cheapest transaction a device can answer.
+def probe_address(transceiver, address):
+  try:
+    status, error, _ = transceiver.transceive(address, bytes([]), None, read_delay=0, timeout=1)
+    return status == transceiver.STATUS_OK and not error
+  except Exception:
+    return False
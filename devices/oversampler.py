@@ -0,0 +1,56 @@
+import numpy as np
+
+
+# A preallocated ring buffer of readings for a fixed set of fields.
+# Rows are samples and columns are fields.  A field missing from a sample is stored as NaN
+# and excluded from that field's statistics.
+class Oversampler(object):
+  def __init__(self, fields, capacity):
+    self.fields = list(fields)
+    self.columns = {field: column for column, field in enumerate(self.fields)}
+    self.capacity = capacity
+    self.buffer = np.full((capacity, len(self.fields)), np.nan)
+    self.position = 0
+    self.count = 0
+
+  def add(self, values):
+    if not values:
+      return
+
+    row = self.buffer[self.position]
+    row.fill(np.nan)
+    for field, value in values.items():
+      column = self.columns.get(field)
+      if column is not None and value is not None:
+        row[column] = value
+
+    self.position = (self.position + 1) % self.capacity
+    self.count = min(self.count + 1, self.capacity)
+
+  def samples(self):
+    return self.buffer[:self.count]
+
+  def reset(self):
+    self.position = 0
+    self.count = 0
+
+  # Returns {field: (mean, min, max, stddev, count)} for every field with at least one sample
+  # since the last summary, and starts a new interval.
+  # All statistics are computed for all fields at once.
+  def summarize(self):
+    samples = self.samples()
+    valid = ~np.isnan(samples)
+    counts = valid.sum(axis=0)
+    divisor = np.maximum(counts, 1)
+
+    means = np.where(valid, samples, 0.0).sum(axis=0) / divisor
+    stddevs = np.sqrt(np.square(np.where(valid, samples - means, 0.0)).sum(axis=0) / divisor)
+    minimums = np.where(valid, samples, np.inf).min(axis=0, initial=np.inf)
+    maximums = np.where(valid, samples, -np.inf).max(axis=0, initial=-np.inf)
+
+    self.reset()
+
+    return {
+        field: (float(means[column]), float(minimums[column]), float(maximums[column]), float(stddevs[column]), int(counts[column]))
+        for column, field in enumerate(self.fields) if counts[column] > 0
+    }
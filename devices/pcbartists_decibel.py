@@ -1,8 +1,34 @@
 #!/usr/bin/env python3
 
+import math
+import os
+import threading
+
+import numpy as np
 from absl import logging
 
-from . import Sensor
+from . import ReadingBatch, Sensor
+from .poller import Poller
+
+# The meter reports whole dB, so the sound energy of every possible reading can be precomputed.
+DB_ENERGY = np.power(10.0, np.arange(256) / 10.0)
+
+
+def acoustic_statistics(levels):
+    """
+    Computes standard acoustic metrics over an interval of dB readings.
+    Ln is the level exceeded n% of the time, so L10 is the 90th percentile.
+    """
+    l90, l50, l10 = np.percentile(levels, [10, 50, 90])
+    return {
+        'sound_level_dB': float(10.0 * np.log10(DB_ENERGY[levels].mean())),
+        'sound_lmax_dB': float(levels.max()),
+        'sound_lmin_dB': float(levels.min()),
+        'sound_l10_dB': float(l10),
+        'sound_l50_dB': float(l50),
+        'sound_l90_dB': float(l90),
+        'sound_sample_count': len(levels)
+    }
 
 
 class PCBArtistsDecibel(Sensor):
@@ -14,13 +40,14 @@ class PCBArtistsDecibel(Sensor):
     DB_REGISTER = 0x0A
 
     def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
-        super().__init__(remotestorage, localstorage, timesource)
+        super().__init__(remotestorage, localstorage, timesource, **kwargs)
 
         self.i2c_transceiver = i2c_transceiver
+        self.i2c_address = self.I2C_ADDRESS
         self.name = "PCBArtistsDecibel"
 
         # Try a simple address probe first (no register read)
-        if not self._probe_device():
+        if not self.probe():
             raise Exception(f"PCBArtistsDecibel not found at address 0x{self.I2C_ADDRESS:02X}")
 
         read_result = self.read()
@@ -29,20 +56,20 @@ class PCBArtistsDecibel(Sensor):
 
         logging.info("Initialized PCBArtists Decibel Sensor at address 0x%02X", self.I2C_ADDRESS)
 
-    def _probe_device(self):
-        """Attempt to detect device presence with minimal bus interaction"""
-        try:
-            # Try a zero-byte write - many I2C implementations support this for device detection
-            status, error, _ = self.i2c_transceiver.transceive(
-                self.I2C_ADDRESS, 
-                bytes([]),  # Empty write
-                0,  # No read
-                read_delay=0, 
-                timeout=1  # Short timeout for probe
-            )
-            return status and not error
-        except:
-            return False
+        # A single reading per interval misses almost every noise event, so when we know the interval
+        # we sample continuously in the background and publish statistics over the whole interval.
+        # Each sample is a single one-byte register read, which is cheap enough for a Pi Zero.
+        self.sample_rate_hz = float(os.getenv('decibel_sample_rate_hz', '20'))
+        self.poller = None
+        if self.interval and self.sample_rate_hz > 0:
+            # Leave room for publish arriving late.
+            capacity = int(math.ceil(self.interval * self.sample_rate_hz * 1.5))
+            self.levels = np.zeros(capacity, dtype=np.uint8)
+            self.level_count = 0
+            self.levels_lock = threading.Lock()
+            self.poller = Poller(self.name, self._sample_level, 1.0 / self.sample_rate_hz)
+        else:
+            self._enable_oversampling(['sound_level_dB'])
 
     def read(self):
         try:
@@ -59,14 +86,72 @@ class PCBArtistsDecibel(Sensor):
             logging.error("Error reading PCBArtistsDecibel: {}".format(str(err)))
             return None
 
+    def _sample_level(self):
+        status, error, data = self.i2c_transceiver.transceive(self.I2C_ADDRESS, bytes([self.DB_REGISTER]), 1, read_delay=0, timeout=1)
+        if not data or len(data) != 1:
+            return
+
+        with self.levels_lock:
+            # Once full, keep the most recent samples.
+            self.levels[self.level_count % len(self.levels)] = data[0]
+            self.level_count += 1
+
+    def _take_levels(self):
+        with self.levels_lock:
+            levels = self.levels[:min(self.level_count, len(self.levels))].copy()
+            self.level_count = 0
+        return levels
+
+    def read_sample(self):
+        db_value = self.read()
+        if db_value is None:
+            return None
+        return {'sound_level_dB': db_value}
+
     def publish(self):
         try:
-            db_value = self.read()
-            if db_value is not None:
-                result = self._try_write('PCBArtistsDecibel', 'sound_level_dB', db_value)
-                return result
+            batch = ReadingBatch('PCBArtistsDecibel')
+
+            if self.poller:
+                levels = self._take_levels()
+
+                # Nothing sampled yet, such as on the first publish right after the sampler started.
+                if not len(levels):
+                    self._sample_level()
+                    levels = self._take_levels()
+
+                if not len(levels):
+                    logging.warning("No samples were collected from PCBArtistsDecibel this interval.")
+                    return self.name
+
+                for field, value in acoustic_statistics(levels).items():
+                    batch.add(field, value)
+            elif self.oversampler:
+                # Include a reading taken right now along with those taken during the interval.
+                self.oversampler.add(self.read_sample())
+                self._add_oversampled(batch)
             else:
-                return False
+                db_value = self.read()
+                if db_value is not None:
+                    batch.add('sound_level_dB', db_value)
+
+            return self._write_batch(batch)
         except Exception as err:
             logging.error("Error publishing Decibel data: {}".format(str(err)))
             return self.name
+
+    def publish_burst(self):
+        """
+        Publishes a single reading without taking the levels sampled so far this interval.
+        """
+        if self.poller:
+            return self._publish_sample()
+        return super().publish_burst()
+
+    def __enter__(self):
+        if self.poller:
+            self.poller.start()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if self.poller:
+            self.poller.stop()
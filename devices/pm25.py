@@ -2,18 +2,18 @@
 
 from absl import logging
 
-import board
-import busio
 from adafruit_pm25.i2c import PM25_I2C
 
-from . import Sensor
+from . import ReadingBatch, Sensor
+from .i2cbus import BusioAdapter
 
 
 class Pm25(Sensor):
-  def __init__(self, remotestorage, localstorage, timesource, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
-    i2c = busio.I2C(board.SCL, board.SDA, frequency=100000)
-    self.pm25 = PM25_I2C(i2c)
+  def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
+    super().__init__(remotestorage, localstorage, timesource, **kwargs)
+    self.i2c_transceiver = i2c_transceiver
+    self.i2c_address = 0x12
+    self.pm25 = PM25_I2C(BusioAdapter(i2c_transceiver), address=self.i2c_address)
     self.name = "PM25"
 
   def read(self):
@@ -26,7 +26,7 @@ class Pm25(Sensor):
 
   def publish(self):
     logging.info('Publishing PM2.5 data')
-    result = False
+    batch = ReadingBatch('PM25')
     try:
       aqdata = self.read()
 
@@ -38,16 +38,11 @@ class Pm25(Sensor):
           remote_key += " ug per m3"
         if remote_key.endswith('standard'):
           remote_key += " ug per m3"
-        # It is actually important that the try_write_to_remote happens before the result, otherwise
-        # it will never be evaluated!
-        try:
-          result = self._try_write('PM25', remote_key, val) or result
-        except Exception as err:
-          self._try_write_error('PM25', remote_key, str(err)) or result
-          raise err
+        batch.add(remote_key, val)
 
     except Exception as err:
       logging.error("Error getting data from PM25.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
-      result = device.name 
+      self._write_batch(batch)
+      return self.name
 
-    return result
+    return self._write_batch(batch)
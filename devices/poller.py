@@ -0,0 +1,48 @@
+import threading
+import time
+
+from absl import logging
+
+
+# Calls a function every `period` seconds on a daemon thread until stopped.
+# Drivers that stream data in the background start one in __enter__ and stop it in __exit__,
+# so the thread lives exactly as long as the sensor's context in the main loop.
+class Poller(object):
+  def __init__(self, name, function, period):
+    self.name = name
+    self.function = function
+    self.period = period
+    self.stop_event = threading.Event()
+    self.thread = None
+
+  def start(self):
+    if self.thread is not None:
+      return
+
+    self.stop_event.clear()
+    self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+    self.thread.start()
+
+  def stop(self, timeout=None):
+    self.stop_event.set()
+    if self.thread is not None:
+      self.thread.join(timeout)
+      self.thread = None
+
+  def _run(self):
+    next_time = time.monotonic()
+    while not self.stop_event.is_set():
+      try:
+        self.function()
+      except Exception as err:
+        logging.error("Error polling {}: {}".format(self.name, str(err)))
+
+      next_time += self.period
+      delay = next_time - time.monotonic()
+
+      # If we fell behind, don't try to catch up with a burst of calls.
+      if delay < 0:
+        next_time = time.monotonic()
+        delay = 0
+
+      self.stop_event.wait(delay)
@@ -0,0 +1,100 @@
+import json
+import math
+import os
+import time
+
+from absl import logging
+
+EARTH_RADIUS_M = 6371000
+
+
+# Distance in meters between two positions, by the equirectangular approximation, which is accurate
+# to well under a meter at the distances that matter here.
+def distance_m(latitude1, longitude1, latitude2, longitude2):
+  x = math.radians(longitude2 - longitude1) * math.cos(math.radians((latitude1 + latitude2) / 2))
+  y = math.radians(latitude2 - latitude1)
+  return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+# Remembers the last known position across restarts, for units that report it when the GPS has no fix.
+# Every fix updates the position in memory, but it is only written to the SD card once the unit has
+# moved at least min_distance_m from the saved position, or the saved position is max_age_sec old.
+# A parked unit therefore writes about once per max_age_sec rather than every cycle.
+# The file is replaced atomically, so that losing power mid-write leaves the old position intact.
+class PositionStore(object):
+  def __init__(self, path, min_distance_m=50, max_age_sec=3600):
+    self.path = path
+    self.min_distance_m = min_distance_m
+    self.max_age_sec = max_age_sec
+    self.latitude = None
+    self.longitude = None
+    self.saved = None
+    self.saved_at = None
+    self._load()
+
+  def _load(self):
+    if self.path and os.path.exists(self.path):
+      try:
+        with open(self.path) as position_file:
+          position = json.load(position_file)
+        self.latitude = float(position['latitude'])
+        self.longitude = float(position['longitude'])
+      except Exception as err:
+        logging.warning("Ignoring unreadable position {}: {}".format(self.path, str(err)))
+
+    # Units upgraded from keeping the position in the env file start from it.
+    if self.latitude is None and os.getenv('last_latitude') and os.getenv('last_longitude'):
+      try:
+        self.latitude = float(os.getenv('last_latitude'))
+        self.longitude = float(os.getenv('last_longitude'))
+      except ValueError:
+        self.latitude = self.longitude = None
+
+    if self.latitude is not None:
+      self.saved = (self.latitude, self.longitude)
+      self.saved_at = time.monotonic()
+
+  # Returns the last known (latitude, longitude), or (None, None) if there has never been a fix.
+  def position(self):
+    return self.latitude, self.longitude
+
+  def update(self, latitude, longitude):
+    self.latitude = latitude
+    self.longitude = longitude
+
+    if (self.saved is None or
+        time.monotonic() - self.saved_at >= self.max_age_sec or
+        distance_m(self.saved[0], self.saved[1], latitude, longitude) >= self.min_distance_m):
+      self.flush()
+
+  # Saves the current position if it differs from the saved one.
+  def flush(self):
+    if not self.path or self.latitude is None or self.saved == (self.latitude, self.longitude):
+      return
+
+    try:
+      temporary_path = self.path + '.tmp'
+      with open(temporary_path, 'w') as position_file:
+        json.dump({'latitude': self.latitude, 'longitude': self.longitude, 'time': time.time()}, position_file)
+      os.replace(temporary_path, self.path)
+    except Exception as err:
+      logging.error("Unable to save position {}: {}".format(self.path, str(err)))
+      return
+
+    self.saved = (self.latitude, self.longitude)
+    self.saved_at = time.monotonic()
+
+
+# The store both GPS drivers use, configured from the environment.
+# Units set up before position_path existed keep the position next to the database.
+def position_store_from_env():
+  path = os.getenv('position_path')
+  if not path and os.getenv('sqlite_db_path'):
+    path = os.path.join(os.path.dirname(os.getenv('sqlite_db_path')), 'last_position.json')
+    logging.warning("position_path is not set, so the last known position is kept in {}.".format(path))
+  elif not path:
+    logging.warning("Neither position_path nor sqlite_db_path is set, so the last known position will not survive a restart.")
+
+  return PositionStore(path,
+                       float(os.getenv('position_save_distance_m', '50')),
+                       float(os.getenv('position_save_max_age_sec', '3600')))
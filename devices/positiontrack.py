@@ -0,0 +1,64 @@
+import collections
+import threading
+import time
+
+# Fixes kept for interpolation.  GPS drivers add about one a second, and readings are written
+# within a few seconds of being taken, so a handful covers every lookup.
+TRACK_LENGTH = 8
+
+
+# A short in-memory track of recent GPS fixes, used to tag every reading with where it was taken.
+# Fixes are kept by monotonic time, so a wall clock step (e.g. a GPS or NTP time sync) between a
+# fix and a reading does not move the reading along the track.
+# A reading between two fixes gets a position interpolated between them; one after the latest fix
+# gets that fix.  No position is given if the nearest fix is more than max_age_sec away.
+class PositionTrack(object):
+  def __init__(self, max_age_sec=10):
+    self.max_age_sec = max_age_sec
+    self.fixes = collections.deque(maxlen=TRACK_LENGTH)
+    self.lock = threading.Lock()
+
+  # Called by the GPS drivers for each new fix.  fix_quality follows the NMEA GGA convention
+  # (1 for GPS, 2 for differential GPS, and so on).
+  def add(self, latitude, longitude, fix_quality, when=None):
+    when = time.monotonic() if when is None else when
+    with self.lock:
+      # Fixes from a background reader can arrive slightly out of order with those from publish.
+      if self.fixes and when <= self.fixes[-1][0]:
+        return
+      self.fixes.append((when, latitude, longitude, fix_quality))
+
+  # Returns (latitude, longitude, fix_quality) at the given monotonic time, or None if unknown.
+  # Lookups are almost always for the present, so the track is searched from the newest fix.
+  def position_at(self, when=None):
+    when = time.monotonic() if when is None else when
+    with self.lock:
+      later = None
+      for fix in reversed(self.fixes):
+        if fix[0] <= when:
+          break
+        later = fix
+      else:
+        fix = None
+
+    if fix is None:
+      if later is None or later[0] - when > self.max_age_sec:
+        return None
+      return later[1:]
+
+    if later is None:
+      if when - fix[0] > self.max_age_sec:
+        return None
+      return fix[1:]
+
+    if later[0] - fix[0] > self.max_age_sec:
+      # Too long between fixes to say where we were in between, so use whichever is closer.
+      nearest = fix if when - fix[0] <= later[0] - when else later
+      if abs(nearest[0] - when) > self.max_age_sec:
+        return None
+      return nearest[1:]
+
+    fraction = (when - fix[0]) / (later[0] - fix[0])
+    return (fix[1] + fraction * (later[1] - fix[1]),
+            fix[2] + fraction * (later[2] - fix[2]),
+            min(fix[3], later[3]))
@@ -0,0 +1,25 @@
+import importlib
+
+# Every supported device, and where its driver lives.
+# Drivers pull in heavy vendor libraries, so a driver module is only imported once its device is
+# probed or bound, and a unit with a single sensor never pays for the others.
+DEVICE_DRIVERS = {
+    'system': 'devices.system:System',
+    'bme688': 'devices.bme688:Bme688',
+    'bmp3xx': 'devices.bmp3xx:Bmp3xx',
+    'uartnmeagps': 'devices.uartnmeagps:UartNmeaGps',
+    'gps': 'devices.gps:Gps',
+    'pm25': 'devices.pm25:Pm25',
+    'sen5x': 'devices.sen5x:Sen5x',
+    'dfrobotmultigas00': 'devices.dfrobot_multigassensor:DFRobotMultiGas00',
+    'dfrobotmultigas01': 'devices.dfrobot_multigassensor:DFRobotMultiGas01',
+    'dfrobotmultigas10': 'devices.dfrobot_multigassensor:DFRobotMultiGas10',
+    'dfrobotmultigas11': 'devices.dfrobot_multigassensor:DFRobotMultiGas11',
+    'pcbartistsdecibel': 'devices.pcbartists_decibel:PCBArtistsDecibel',
+}
+
+
+# Returns the driver class for a device, importing its module on first use.
+def load_driver(name):
+  module_name, class_name = DEVICE_DRIVERS[name].split(':')
+  return getattr(importlib.import_module(module_name), class_name)
@@ -6,25 +6,38 @@ import time
 from sensirion_i2c_driver import I2cConnection, LinuxI2cTransceiver
 from sensirion_i2c_sen5x import Sen5xI2cDevice
 
-from . import Sensor
+from . import ReadingBatch, Sensor
 
 # Based on https://sensirion.github.io/python-i2c-sen5x/quickstart.html#linux-i2c-bus-example
 class Sen5x(Sensor):
   def __init__(self, remotestorage, localstorage, timesource, i2c_transceiver, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
+    super().__init__(remotestorage, localstorage, timesource, **kwargs)
 
     self.i2c_transceiver = i2c_transceiver
+    self.i2c_address = 0x69
     self.device = Sen5xI2cDevice(I2cConnection(i2c_transceiver))
     self.has_transmitted_device_info = False
 
     logging.info("SEN5X Version: {}".format(self.device.get_version()))
-    logging.info("SEN5X Product Name: {}".format(self.device.get_product_name()))
-    logging.info("SEN5X Serial Number: {}".format(self.device.get_serial_number()))
+    self.product_name = self.device.get_product_name()
+    self.serial_number = self.device.get_serial_number()
+    logging.info("SEN5X Product Name: {}".format(self.product_name))
+    logging.info("SEN5X Serial Number: {}".format(self.serial_number))
  
     # Perform a device reset (reboot firmware)
     self.device.device_reset()
     self.name = "SEN5X"
 
+    # The SEN5X updates its measurements once per second, so it is worth reading many times per interval.
+    self._enable_oversampling(['humidity_percent', 'temperature_C', 'pm10.0_ug_m3', 'pm1.0_ug_m3',
+                               'pm2.5_ug_m3', 'pm4.0_ug_m3', 'nox_index', 'voc_index'])
+
+  def fingerprint(self):
+    fingerprint = super().fingerprint()
+    fingerprint['product_name'] = self.product_name
+    fingerprint['serial_number'] = self.serial_number
+    return fingerprint
+
   def read(self):
     if not self.device.read_data_ready():
       return None 
@@ -34,101 +47,57 @@ class Sen5x(Sensor):
 
     return values
 
+  def read_sample(self):
+    data = self.read()
+    if not data:
+      return None
+
+    values = {
+        'humidity_percent': data.ambient_humidity.percent_rh,
+        'temperature_C': data.ambient_temperature.degrees_celsius,
+        'pm10.0_ug_m3': data.mass_concentration_10p0.physical,
+        'pm1.0_ug_m3': data.mass_concentration_1p0.physical,
+        'pm2.5_ug_m3': data.mass_concentration_2p5.physical,
+        'pm4.0_ug_m3': data.mass_concentration_4p0.physical,
+        'nox_index': data.nox_index.scaled,
+        'voc_index': data.voc_index.scaled
+    }
+
+    # NAN values are NOT valid JSON.  We will not send anything if a nan value is ever found for any reason.
+    return {field: value for field, value in values.items() if not math.isnan(value)}
+
   def publish(self):
     logging.info('Publishing SEN5X data')
+    batch = ReadingBatch('SEN5X')
     result = False
     try:
-      data = self.read()
+      data = self.read_sample()
 
       if not self.has_transmitted_device_info:
-        try:
-          result = self._try_write('SEN5X', 'firmware_version', '{}.{}'.format(self.device.get_version().firmware.major, self.device.get_version().firmware.minor)) or result
-        except Exception as err:
-          self._try_write_error('SEN5X', 'firmware_version', str(err))
-          raise err
-
-        try:
-          result = self._try_write('SEN5X', 'hardware_version', '{}.{}'.format(self.device.get_version().hardware.major, self.device.get_version().hardware.minor)) or result
-        except Exception as err:
-          self._try_write_error('SEN5X', 'hardware_version', str(err))
-          raise err
-
-        try:
-          result = self._try_write('SEN5X', 'protocol_version', '{}.{}'.format(self.device.get_version().protocol.major, self.device.get_version().protocol.minor)) or result
-        except Exception as err:
-          self._try_write_error('SEN5X', 'protocol_version', str(err))
-          raise err
-
-        try:
-          result = self._try_write('SEN5X', 'product_name', self.device.get_product_name()) or result
-        except Exception as err:
-          self._try_write_error('SEN5X', 'product_name', str(err))
-          raise err
-
-        try:
-          result = self._try_write('SEN5X', 'serial_number', self.device.get_serial_number()) or result
-        except Exception as err:
-          self._try_write_error('SEN5X', 'serial_number', str(err))
-          raise err
-
-        self.has_transmitted_device_info = True
-
-      if data:
-        # NAN values are NOT valid JSON.  We will not send anything if a nan value is ever found for any reason.
-        if not math.isnan(data.ambient_humidity.percent_rh):
-          try:
-            result = self._try_write('SEN5X', 'humidity_percent', data.ambient_humidity.percent_rh) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'humidity_percent', str(err))
-            raise err
-        if not math.isnan(data.ambient_temperature.degrees_celsius):
-          try:
-            result = self._try_write('SEN5X', 'temperature_C', data.ambient_temperature.degrees_celsius) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'temperature_C', str(err))
-            raise err
-        if not math.isnan(data.mass_concentration_10p0.physical):
-          try:
-            result = self._try_write('SEN5X', 'pm10.0_ug_m3', data.mass_concentration_10p0.physical) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'pm10.0_ug_m3', str(err))
-            raise err
-        if not math.isnan(data.mass_concentration_1p0.physical):
-          try:
-            result = self._try_write('SEN5X', 'pm1.0_ug_m3', data.mass_concentration_1p0.physical) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'pm1.0_ug_m3', str(err))
-            raise err
-        if not math.isnan(data.mass_concentration_2p5.physical):
-          try:
-            result = self._try_write('SEN5X', 'pm2.5_ug_m3', data.mass_concentration_2p5.physical) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'pm2.5_ug_m3', str(err))
-            raise err
-        if not math.isnan(data.mass_concentration_4p0.physical):
-          try:
-            result = self._try_write('SEN5X', 'pm4.0_ug_m3', data.mass_concentration_4p0.physical) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'pm4.0_ug_m3', str(err))
-            raise err
-        if not math.isnan(data.nox_index.scaled):
-          try:
-            result = self._try_write('SEN5X', 'nox_index', data.nox_index.scaled) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'nox_index', str(err))
-            raise err
-        if not math.isnan(data.voc_index.scaled):
-          try:
-            result = self._try_write('SEN5X', 'voc_index', data.voc_index.scaled) or result
-          except Exception as err:
-            self._try_write_error('SEN5X', 'voc_index', str(err))
-            raise err
+        version = self.device.get_version()
+        batch.add('firmware_version', '{}.{}'.format(version.firmware.major, version.firmware.minor))
+        batch.add('hardware_version', '{}.{}'.format(version.hardware.major, version.hardware.minor))
+        batch.add('protocol_version', '{}.{}'.format(version.protocol.major, version.protocol.minor))
+        batch.add('product_name', self.product_name)
+        batch.add('serial_number', self.serial_number)
+
+      if self.oversampler:
+        # Include a reading taken right now along with those taken during the interval.
+        self.oversampler.add(data)
+        self._add_oversampled(batch)
+      elif data:
+        for field, value in data.items():
+          batch.add(field, value)
       else:
         logging.info("Data was not ready for SEN5X.")
     except Exception as err:
       logging.error("Error getting data from SEN5X.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
       result = self.name
 
+    result = self._write_batch(batch) or result
+    if not result:
+      self.has_transmitted_device_info = True
+
     return result
 
   def __enter__(self):
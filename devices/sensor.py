@@ -1,14 +1,154 @@
+import math
 import os
+import time
 
 from absl import logging
 
+from localstorage import Reading
+
+from .i2cbus import probe_address
+
+
+# The readings and errors collected during one publish.
+# Drivers add to a batch as they read, then hand it to Sensor._write_batch.
+class ReadingBatch(object):
+  def __init__(self, point):
+    self.point = point
+    self.readings = []
+    # Drivers create the batch before reading the device, so this is about when the readings were taken.
+    self.started = time.monotonic()
+    # Set by drivers that write readings taken earlier, to the time source's get_time_ns and
+    # get_clock_offset when they were taken.
+    self.time = None
+    self.clock_offset = None
+
+  def add(self, field, value, point=None):
+    self.readings.append(Reading(point or self.point, field, value=value))
+
+  def add_error(self, field, error, point=None):
+    self.readings.append(Reading(point or self.point, field, message=str(error)))
+
+  def __len__(self):
+    return len(self.readings)
+
 
 class Sensor(object):
-  def __init__(self, remotestorage, localstorage, timesource, log_errors=False, **kwargs):
+  def __init__(self, remotestorage, localstorage, timesource, log_errors=False, interval=None, oversample_interval=None, burst_controller=None, deadband_filter=None, position_track=None, **kwargs):
     self.remotestorage = remotestorage
     self.localstorage = localstorage
     self.timesource = timesource
     self.log_errors = log_errors
+    self.interval = interval
+    self.oversample_interval = oversample_interval
+    self.oversampler = None
+    self.burst_controller = burst_controller
+    self.deadband_filter = deadband_filter
+    # When set, every reading is tagged with where it was taken.  GPS drivers also add their fixes to it.
+    self.position_track = position_track
+
+    # Set by the main loop while this sensor is publishing outside of the regular cycle.
+    self.bursting = False
+
+    # Set by the main loop to a SensorHealth, to quarantine this sensor when it keeps failing.
+    self.health = None
+
+    # Drivers that read the device in the background set this to their Poller.
+    self.poller = None
+
+    # Drivers on the shared I2C transceiver set these so that probe() can find the device.
+    self.i2c_transceiver = None
+    self.i2c_address = None
+
+    # Set by the main loop for sensors on an additional I2C bus, to tell their points apart from the
+    # same device on the primary bus, e.g. SEN5X@i2c-3.
+    self.point_suffix = ''
+
+  # Identifies the installed device, so that a warm boot can tell whether it has been swapped.
+  # Drivers add whatever else the device reports about itself, such as a serial number.
+  def fingerprint(self):
+    fingerprint = {}
+    if self.i2c_address is not None:
+      fingerprint['address'] = self.i2c_address
+    return fingerprint
+
+  # A cheap check that the device is still there, used before reinstating a quarantined sensor.
+  # Drivers that cannot be probed are assumed to be present, and the next publish decides.
+  def probe(self):
+    if self.i2c_transceiver is None or self.i2c_address is None:
+      return True
+    return probe_address(self.i2c_transceiver, self.i2c_address)
+
+  # Called by the main loop when this sensor is quarantined, and again when it is reinstated.
+  def pause(self):
+    if self.poller:
+      self.poller.stop()
+
+  def resume(self):
+    if self.poller:
+      self.poller.start()
+
+  # Drivers that can be read many times per interval call this with the fields read_sample returns.
+  # Oversampling is only enabled when the main loop asks for it with an oversample_interval.
+  def _enable_oversampling(self, fields):
+    if self.interval and self.oversample_interval:
+      # The oversampler needs numpy, which is slow to import on a Pi Zero, so it is only imported when used.
+      from .oversampler import Oversampler
+
+      # Leave a little room for timing jitter in the sampling loop.
+      capacity = int(math.ceil(self.interval / self.oversample_interval)) + 2
+      self.oversampler = Oversampler(fields, capacity)
+
+  # Returns a dict of field to numeric value for one reading, or None if no reading is available.
+  # Drivers supporting oversampling override this.
+  def read_sample(self):
+    return None
+
+  # Called by the main loop every oversample_interval between publishes.
+  def sample(self):
+    if self.oversampler is None or (self.health and self.health.quarantined):
+      return
+
+    try:
+      values = self.read_sample()
+      self.oversampler.add(values)
+
+      # Oversampled drivers write to a point named after themselves, so sub-interval readings can trigger bursts too.
+      if values and self.burst_controller:
+        for field, value in values.items():
+          self.burst_controller.observe(self.name, self.name, field, value)
+    except Exception as err:
+      logging.error("Error oversampling {}: {}".format(self.name, str(err)))
+
+  # Called by the main loop, between regular publishes, while this sensor is in a burst.
+  # A burst sample is a single reading taken right now.  It must never take from what is being collected
+  # for the interval, so that the regular publish reports the same statistics with or without bursts.
+  # Drivers that keep nothing between publishes can publish as usual.
+  def publish_burst(self):
+    if self.oversampler is None:
+      return self.publish()
+    return self._publish_sample()
+
+  # Writes one read_sample to a point named after this sensor, leaving the oversampler alone.
+  def _publish_sample(self):
+    batch = ReadingBatch(self.name)
+    try:
+      for field, value in (self.read_sample() or {}).items():
+        batch.add(field, value)
+    except Exception as err:
+      logging.error("Error taking a burst sample from {}: {}".format(self.name, str(err)))
+      return self.name
+
+    return self._write_batch(batch)
+
+  # Adds the mean of each oversampled field under its usual name to the batch, along with its
+  # min, max, stddev and sample count for the interval.
+  def _add_oversampled(self, batch):
+    for field, (mean, minimum, maximum, stddev, count) in self.oversampler.summarize().items():
+      batch.add(field, mean)
+      batch.add(field + '_min', minimum)
+      batch.add(field + '_max', maximum)
+      batch.add(field + '_stddev', stddev)
+      batch.add(field + '_count', count)
 
   # Even though we never explicitly create rows, InfluxDB assigns a type
   # when a row is first written.  Apparently, sometimes intended float values are incorrectly
@@ -19,36 +159,49 @@ class Sensor(object):
       return float(value)
     return value
 
-  def _try_write_error(self, point, field, error):
-    if self.name == 'System':
-      error_field = 'error'
-    else:
-      error_field = 'message'
-
-    if self.log_errors:
-      try:
-        data_json = {
-            'point': point,
-            'field': field,
-            error_field: str(error),
-            'time': self.timesource.get_time()
-        }
-
-        self.localstorage.writejson(data_json);
-      except Exception as backup_err:
-        logging.error("Error saving data to local disk: " + str(backup_err))
+  # Stamps everything in the batch with a single time and saves it to disk with a single call.
+  # Returns False on success, or this sensor's name if the batch could not be saved.
+  def _write_batch(self, batch):
+    if not batch.readings:
+      return False
 
-  def _try_write(self, point, field, value):
-    # Always save to disk first.
     try:
-      data_json = {
-          'point': point,
-          'field': field,
-          'value': self._make_ints_to_float(value),
-          'time': self.timesource.get_time()
-      }
+      if batch.time:
+        timestamp, clock_offset = batch.time, batch.clock_offset
+      else:
+        timestamp, clock_offset = self.timesource.get_time_ns(), self.timesource.get_clock_offset()
+      position = self.position_track.position_at(batch.started) if self.position_track else None
+      readings = []
+      for reading in batch.readings:
+        if self.point_suffix:
+          reading.point += self.point_suffix
+
+        if reading.message is not None:
+          if not self.log_errors:
+            continue
+
+          # System errors are stored as errors, and everything else as messages.
+          if self.name == 'System':
+            reading.error, reading.message = reading.message, None
+        else:
+          if self.burst_controller:
+            self.burst_controller.observe(self.name, reading.point, reading.field, reading.value)
+
+          # Values within the deadband of the last stored value are not stored.  Burst samples are always kept.
+          if self.deadband_filter and not self.bursting and not self.deadband_filter.should_write(reading.point, reading.field, reading.value):
+            continue
+
+          reading.value = self._make_ints_to_float(reading.value)
 
-      self.localstorage.writejson(data_json);
+        reading.time = timestamp
+        reading.clock_offset = clock_offset
+        reading.burst = self.bursting
+        if position:
+          reading.latitude, reading.longitude, reading.fix_quality = position
+        readings.append(reading)
+
+      if readings:
+        self.localstorage.writereadings(readings)
 
       return False
     except Exception as backup_err:
@@ -56,6 +209,16 @@ class Sensor(object):
       logging.error("Error saving data to local disk: " + str(backup_err))
       return self.name
 
+  def _try_write_error(self, point, field, error):
+    batch = ReadingBatch(point)
+    batch.add_error(field, error)
+    self._write_batch(batch)
+
+  def _try_write(self, point, field, value):
+    batch = ReadingBatch(point)
+    batch.add(field, value)
+    return self._write_batch(batch)
+
   def __enter__(self):
     pass
 
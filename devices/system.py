@@ -1,47 +1,57 @@
 #!/usr/bin/env python3
 
+import os
 import psutil
 import time
 
 from absl import logging
-from . import Sensor
+from . import ReadingBatch, Sensor
 
 
 class System(Sensor):
   def __init__(self, remotestorage, localstorage, timesource, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
+    super().__init__(remotestorage, localstorage, timesource, **kwargs)
     self.start_time = time.time()
     self.name = "System"
     self.has_reported_firmware_version=False
 
+    # The I2C buses by label, if we are the System sensor of the main loop.
+    self.i2c_buses = kwargs.get('i2c_buses') or {}
+
   def publish(self):
     logging.info('Publishing system stats')
-    result = False
-
-    # It is actually important that the try_write_to_remote happens before the result, otherwise
-    # it will never be evaluated!
+    batch = ReadingBatch('System')
 
     try:
-      result = self._try_write('System', 'device_uptime_sec', time.time() - psutil.boot_time()) or result
+      batch.add('device_uptime_sec', time.time() - psutil.boot_time())
     except Exception as err:
-      self._try_write_error('System', 'device_uptime_sec', str(err))
+      batch.add_error('device_uptime_sec', str(err))
 
     try:
-      result = self._try_write('System', 'service_uptime_sec', time.time() - psutil.boot_time()) or result
+      batch.add('service_uptime_sec', time.time() - psutil.boot_time())
     except Exception as err:
-      self._try_write_error('System', 'service_uptime_sec', str(err))
+      batch.add_error('service_uptime_sec', str(err))
 
-    try:
-      result = self._try_write('System', 'system_time_utc', time.time()) or result
-    except Exception as err:
-      self._try_write_error('System', 'system_time_utc', str(err))
+    batch.add('system_time_utc', time.time())
 
     # Only report the firmware version once per build.
     if not self.has_reported_firmware_version:
-      try:
-        result = self._try_write('System', 'simpleaq_build', os.getenv('image_name', 'unspecified')) or result
-        self.has_reported_firmware_version = True
-      except Exception as err:
-        self._try_write_error('System', 'simpleaq_build', str(err))
+      batch.add('simpleaq_build', os.getenv('image_name', 'unspecified'))
+
+    # Report how many rows the deadband filter saved us once a day.
+    if self.deadband_filter:
+      counts = self.deadband_filter.take_daily_counts()
+      if counts:
+        batch.add('rows_written_per_day', counts[0])
+        batch.add('rows_suppressed_per_day', counts[1])
+
+    # Bus utilization and contention since the last publish.  Fields of additional buses are suffixed with the bus.
+    for bus_label, bus in self.i2c_buses.items():
+      for field, value in bus.take_statistics().items():
+        batch.add(field + ('@' + bus_label if bus_label else ''), value)
+
+    result = self._write_batch(batch)
+    if not result:
+      self.has_reported_firmware_version = True
 
     return result
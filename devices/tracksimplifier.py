@@ -0,0 +1,146 @@
+import math
+import os
+
+from .positionstore import EARTH_RADIUS_M, position_store_from_env
+from .sensor import ReadingBatch
+
+
+# Drops GPS fixes that add nothing to the route, as they arrive.
+# This is the opening window form of Douglas-Peucker: fixes since the last kept one are held back
+# while every one of them is within tolerance_m of the straight line from the last kept fix to the
+# newest.  When a new fix breaks that, the one before it is kept and becomes the start of the next
+# window.  Joining the kept fixes with straight lines therefore reproduces every dropped fix to
+# within tolerance_m.
+# At most max_points fixes are held back, which bounds both memory and how late a fix is written.
+class TrackSimplifier(object):
+  def __init__(self, tolerance_m, max_points=32):
+    self.tolerance_m = tolerance_m
+    self.max_points = max_points
+    self.anchor = None
+    self.pending = []
+    self.points_in = 0
+    self.points_kept = 0
+
+  # Fixes are (latitude, longitude, payload), where the payload is whatever the caller needs to
+  # write the fix later.
+  # Adds a fix, and returns the fixes that must now be kept, oldest first.
+  def add(self, fix):
+    self.points_in += 1
+    if self.anchor is None:
+      return self._keep(fix)
+
+    if self.pending and (len(self.pending) >= self.max_points or not self._fits(fix)):
+      kept = self._keep(self.pending[-1])
+      self.pending = [fix]
+      return kept
+
+    self.pending.append(fix)
+    return []
+
+  # Keeps the last fix held back, ending the track there, e.g. when the fix is lost or on shutdown.
+  def flush(self):
+    if not self.pending:
+      return []
+    kept = self._keep(self.pending[-1])
+    self.pending = []
+    return kept
+
+  # How many fixes were seen for every one kept.
+  @property
+  def compression_ratio(self):
+    return self.points_in / max(self.points_kept, 1)
+
+  def _keep(self, fix):
+    self.anchor = fix
+    self.points_kept += 1
+    return [fix]
+
+  def _fits(self, end):
+    # Project onto a flat plane in meters around the anchor, which is plenty accurate over a window.
+    latitude_scale = math.radians(1) * EARTH_RADIUS_M
+    longitude_scale = latitude_scale * math.cos(math.radians(self.anchor[0]))
+
+    def project(fix):
+      return ((fix[1] - self.anchor[1]) * longitude_scale, (fix[0] - self.anchor[0]) * latitude_scale)
+
+    end_x, end_y = project(end)
+    length_squared = end_x * end_x + end_y * end_y
+    for fix in self.pending:
+      x, y = project(fix)
+      # Distance to the segment, not the line, so that doubling back is not mistaken for a straight run.
+      along = 0 if length_squared == 0 else max(0, min(1, (x * end_x + y * end_y) / length_squared))
+      if math.hypot(x - along * end_x, y - along * end_y) > self.tolerance_m:
+        return False
+    return True
+
+
+# Returns a batch for each kept fix, stamped with when the fix was taken rather than when it is written.
+# Kept fixes' payloads are (started, timestamp, clock_offset), as ReadingBatch.started and the time source gave them.
+def track_batches(point, fixes, compression_ratio):
+  batches = []
+  for latitude, longitude, (started, timestamp, clock_offset) in fixes:
+    batch = ReadingBatch(point)
+    batch.started = started
+    batch.time = timestamp
+    batch.clock_offset = clock_offset
+    batch.add('latitude_degrees', latitude)
+    batch.add('longitude_degrees', longitude)
+    batch.add('track_compression_ratio', compression_ratio)
+    batches.append(batch)
+  return batches
+
+
+# The simplifier configured from the environment, or None if track simplification is off.
+def track_simplifier_from_env():
+  tolerance_m = float(os.getenv('gps_track_tolerance_m') or 0)
+  if tolerance_m <= 0:
+    return None
+  return TrackSimplifier(tolerance_m, int(os.getenv('gps_track_max_points') or 32))
+
+
+# What both GPS drivers do with their fixes, for Sensor subclasses with send_last_known_gps set.
+# The position store is the last known position, and the position track tags other readings with
+# where they were taken.  With track simplification on, fixes go through the simplifier, and only
+# those needed to reproduce the route are written, each in its own batch at the time it was taken.
+class GpsPositionMixin(object):
+  def _init_position(self):
+    self.position_store = position_store_from_env()
+    self.track_simplifier = track_simplifier_from_env()
+
+  # Called for every fix the driver sees, which may be more often than it publishes.
+  def _track_fix(self, latitude, longitude, fix_quality, when=None):
+    if self.position_track:
+      self.position_track.add(latitude, longitude, fix_quality, when)
+
+  # Adds a fix to the batch, or to the simplified track.  Returns the track fixes to write.
+  def _add_position(self, batch, latitude, longitude):
+    self.position_store.update(latitude, longitude)
+    if self.track_simplifier is None:
+      batch.add('latitude_degrees', latitude)
+      batch.add('longitude_degrees', longitude)
+      return []
+    return self.track_simplifier.add((latitude, longitude, (batch.started, self.timesource.get_time_ns(), self.timesource.get_clock_offset())))
+
+  # Without a fix the route ends at the last one, so it is kept, and the last known position is
+  # sent if wanted.  Returns the track fixes to write.
+  def _add_lost_position(self, batch):
+    latitude, longitude = self.position_store.position()
+    if self.send_last_known_gps and latitude is not None and longitude is not None:
+      batch.add('latitude_degrees', latitude)
+      batch.add('longitude_degrees', longitude)
+      batch.add('last_known_gps_reading', 1)
+    return self._end_track()
+
+  def _end_track(self):
+    return self.track_simplifier.flush() if self.track_simplifier else []
+
+  def _write_track(self, fixes):
+    result = False
+    for track_batch in track_batches('GPS', fixes, self.track_simplifier.compression_ratio if fixes else None):
+      result = self._write_batch(track_batch) or result
+    return result
+
+  # Called on shutdown, so that neither the last position nor the end of the route is lost.
+  def _close_position(self):
+    self.position_store.flush()
+    self._write_track(self._end_track())
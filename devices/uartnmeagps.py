@@ -1,106 +1,97 @@
 #!/usr/bin/env python3
-import gpsd
 
 import datetime
-import dotenv
 import os
 import time
 import sys
 from pathlib import Path
 from absl import logging
-from . import Sensor
+from . import ReadingBatch, Sensor
+from .gpsdclient import GpsdClient
+from .tracksimplifier import GpsPositionMixin
 
 
-class UartNmeaGps(Sensor):
-  def __init__(self, remotestorage, localstorage, timesource, interval=None, send_last_known_gps=False, env_file=None, **kwargs):
-    super().__init__(remotestorage, localstorage, timesource)
-    # Stream represents our connection to the UART.
+class UartNmeaGps(GpsPositionMixin, Sensor):
+  def __init__(self, remotestorage, localstorage, timesource, interval=None, send_last_known_gps=False, **kwargs):
+    super().__init__(remotestorage, localstorage, timesource, interval=interval, **kwargs)
     self.timesource = timesource
     self.has_transmitted_device_info = False
     self.name = "UARTNMEAGPS"
     self.has_set_time = False
 
-    # If available, we will save last known GPS coordinates to environment variables.
-    self.env_file = env_file
     self.send_last_known_gps = send_last_known_gps
-
-    # Seed last_latitude and last_longitude from the environment variable, if available.
     self.interval = interval
 
-    self.last_known_latitude = os.getenv('last_latitude')
-    self.last_known_longitude = os.getenv('last_longitude')
+    # The last known position survives restarts, so it can be sent when there is no fix.
+    self._init_position()
+
+    # gpsd owns the UART.  A client keeps a WATCH stream open to it in the background, so publish
+    # only reads the latest reports instead of waiting on gpsd every cycle.
+    # A report older than gpsd_stale_sec means gpsd or the receiver has gone quiet, so it is not a fix.
+    self.stale_sec = float(os.getenv('gpsd_stale_sec', '5'))
+    self.client = GpsdClient(os.getenv('gpsd_host', '127.0.0.1'), int(os.getenv('gpsd_port', '2947')))
+    if self.position_track:
+      self.client.on_tpv = self._add_to_track
 
     try:
-      gpsd.connect()
-      packet = gpsd.get_current()
+      self.client.check()
     except Exception as err:
       logging.error("UARTNMEAGPS could not connect to GPSD: {}".format(str(err)))
       raise Exception("UARTNMEAGPS could not connect to GPSD: {}".format(str(err)))
 
+  # gpsd's status follows the NMEA GGA fix quality closely enough: 1 for GPS, 2 for differential GPS.
+  def _add_to_track(self, report):
+    tpv = report.message
+    if tpv.get('mode', 0) >= 2 and tpv.get('lat') is not None and tpv.get('lon') is not None:
+      self._track_fix(tpv['lat'], tpv['lon'], tpv.get('status', 1), report.received)
+
+  def _current(self, report):
+    if report is None or report.age() > self.stale_sec:
+      return {}
+    return report.message
+
   def publish(self):
     logging.info('Publishing GPS data')
 
-
+    batch = ReadingBatch('GPS')
     result = False
+    track = []
     try:
       if not self.has_transmitted_device_info:
-        try:
-          result = self._try_write('GPS', 'Model', 'Generic UART NMEA/UBX GPS') or result
-          self.has_transmitted_device_info = True
-        except Exception as err:
-          self._try_write_error('GPS', 'Model', str(err))
-          raise err
+        batch.add('Model', 'Generic UART NMEA/UBX GPS')
+
+      tpv = self._current(self.client.tpv)
+      sky = self._current(self.client.sky)
 
-      packet = gpsd.get_current()
+      # Satellites are worth reporting with or without a fix, since they show why there isn't one.
+      if 'uSat' in sky:
+        batch.add('satellites_used', sky['uSat'])
+        batch.add('satellites_visible', sky['nSat'])
+      if sky.get('hdop') is not None:
+        batch.add('hdop', sky['hdop'])
 
       # See if we actually have a fix.
-      if packet.mode >= 2:
-
-        # 3D fix.
-        if packet.mode == 3:
-          # Write altitude
-          try:
-            result = self._try_write('GPS', 'altitude_meters', packet.altitude()) or result
-          except Exception as err:
-            self._try_write_error('GPS', 'altitude_meters', str(err))
-            raise err
-
-        # See if we have latitude and longitude
-        latitude, longitude = packet.position()
-
-        self.last_known_latitude = latitude
-        self.last_known_longitude = longitude
-
-        # Save the last-known lat and lon.
-        if self.env_file:
-          dotenv.set_key(
-              self.env_file,
-              'last_latitude',
-              str(latitude))
-          dotenv.set_key(
-              self.env_file,
-              'last_longitude',
-              str(longitude))
-
-        # Write latitude and longitude
-        try:
-          result = self._try_write('GPS', 'latitude_degrees', latitude) or result
-        except Exception as err:
-          self._try_write_error('GPS', 'latitude_degrees', str(err))
-          raise err
-
-        try:
-          result = self._try_write('GPS', 'longitude_degrees', longitude) or result
-        except Exception as err:
-          self._try_write_error('GPS', 'longitude_degrees', str(err))
-          raise err
-
-        result = self._try_write('GPS', 'last_known_gps_reading', 0) or result
+      if tpv.get('mode', 0) >= 2 and tpv.get('lat') is not None and tpv.get('lon') is not None:
+
+        # 3D fix.  gpsd 3.20 renamed alt to altMSL.
+        altitude = tpv.get('altMSL', tpv.get('alt'))
+        if tpv['mode'] == 3 and altitude is not None:
+          batch.add('altitude_meters', altitude)
+
+        track = self._add_position(batch, tpv['lat'], tpv['lon'])
+        batch.add('last_known_gps_reading', 0)
+
+        if tpv.get('speed') is not None:
+          batch.add('speed_m_s', tpv['speed'])
+        if tpv.get('track') is not None:
+          batch.add('track_degrees', tpv['track'])
+        if tpv.get('ept') is not None:
+          batch.add('time_error_sec', tpv['ept'])
 
         # Update time if needed.
-        if packet.get_time(local_time=False):
+        if tpv.get('time'):
           if self.interval:
-            epoch_seconds = packet.get_time(local_time=False).timestamp()
+            epoch_seconds = datetime.datetime.fromisoformat(tpv['time'].replace('Z', '+00:00')).timestamp()
 
             if abs(time.time() - epoch_seconds) > self.interval:
               logging.warning(
@@ -113,17 +104,29 @@ class UartNmeaGps(Sensor):
               self.has_set_time = True
       else:
         logging.warn("UARTNMEAGPS had no fix data available.")
-
-        # If available, send the last-known GPS
-        if self.send_last_known_gps:
-          # If desired, send the last-known GPS values.
-          if self.last_known_latitude is not None and self.last_known_longitude is not None and self.last_known_latitude != "" and self.last_known_longitude != "":
-            result = self._try_write('GPS', 'latitude_degrees', float(self.last_known_latitude)) or result
-            result = self._try_write('GPS', 'longitude_degrees', float(self.last_known_longitude)) or result
-            result = self._try_write('GPS', 'last_known_gps_reading', 1) or result
+        track = self._add_lost_position(batch)
 
     except Exception as err:
       logging.error("Error getting data from GPS.  Is this sensor correctly installed and the cable attached tightly:  " + str(err));
       result = self.name
 
+    result = self._write_batch(batch) or result
+    result = self._write_track(track) or result
+    if not result:
+      self.has_transmitted_device_info = True
+
     return result
+
+  # gpsd keeps reading the receiver either way, but there is no point streaming its reports while quarantined.
+  def pause(self):
+    self.client.stop()
+
+  def resume(self):
+    self.client.start()
+
+  def __enter__(self):
+    self.client.start()
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    self.client.stop()
+    self._close_position()
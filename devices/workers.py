@@ -0,0 +1,45 @@
+import concurrent.futures
+
+
+# Runs work for the sensors on each I2C bus on a thread of that bus's own, so that transactions on
+# different buses proceed in parallel while the sensors on one bus still take turns.
+# Sensors not on I2C are run on the calling thread in the meantime.
+class BusWorkers(object):
+  def __init__(self):
+    self.executors = {}
+
+  # Calls function(sensor) for every sensor, and returns the results in the order of the sensors.
+  def map(self, function, sensors):
+    groups = {}
+    for index, sensor in enumerate(sensors):
+      groups.setdefault(sensor.i2c_transceiver, []).append(index)
+
+    local_indices = groups.pop(None, [])
+
+    # With a single bus there is nothing to overlap, so skip the thread hop.
+    if len(groups) <= 1:
+      return [function(sensor) for sensor in sensors]
+
+    futures = []
+    for bus, indices in groups.items():
+      executor = self.executors.get(bus)
+      if executor is None:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='BusWorker')
+        self.executors[bus] = executor
+      futures.append((indices, executor.submit(lambda indices=indices: [function(sensors[index]) for index in indices])))
+
+    results = [None] * len(sensors)
+    for index in local_indices:
+      results[index] = function(sensors[index])
+
+    for indices, future in futures:
+      for index, result in zip(indices, future.result()):
+        results[index] = result
+    return results
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    for executor in self.executors.values():
+      executor.shutdown()
@@ -2,11 +2,9 @@ from flask import Flask, render_template, request, make_response, Response, redi
 import dotenv
 import getmac
 import os
-import json
 import re
 import shlex
 import subprocess
-import sqlite3
 import logging
 from localstorage.localsqlite import LocalSqlite
 
@@ -131,53 +129,13 @@ def main():
 
 @app.route('/simpleaq.ndjson', methods=('GET',))
 def download():
-  touch_every = int(os.getenv('hostap_retry_interval_sec', '100'))
+  # The storage is opened inside the generator, since the streaming response only runs it after
+  # download returns.  Opening it also creates the database if necessary.
+  def generate():
+    with LocalSqlite(os.getenv("sqlite_db_path")) as local_storage:
+      yield from local_storage.exportndjson()
 
-  def generate(connection, cursor):
-    count = 0
-    data = cursor.fetchone()
-
-    while data:
-      try:
-        # Maybe prevent HostAP switching during a large download.
-        count += 1
-        if count > touch_every:
-          count = 0
-
-        # Make sure we only return valid JSON
-        data_jsonstr = json.dumps(json.loads(data[1]))
-        yield data_jsonstr + '\n'
-      except Exception:
-        # Doesn't matter, don't let a bad file spoil the download.
-        pass
-
-      data = cursor.fetchone()
-
-    cursor.close()
-    connection.close()
-
-  # Make sure there's a place to actually put the backlog database if necessary.
-  os.makedirs(os.path.dirname(os.getenv("sqlite_db_path")), exist_ok=True)
-
-  # Implcitly create the database.
-  with LocalSqlite(os.getenv("sqlite_db_path")) as local_storage:
-    pass
-
-  # No, we cannot use contextlib.closing or a with block here.
-  # The WSGI middleware in the streaming response generator will close them before
-  # generate can be called!  
-  # There is no clear path to refactor this into the local_storage paradigm.
-  # TODO:  Figure out a way.  Maybe if "generate" existed within the "with" block?
-  # That would be weird but might just work.
-
-  # This implicitly creates the database.
-  db_conn = sqlite3.connect(os.getenv("sqlite_db_path"))
-
-  # OK, we need a table to store backlog data if it doesn't exist.
-  cursor = db_conn.cursor()
-  cursor.execute("SELECT * FROM data")
-
-  return Response(generate(db_conn, cursor), mimetype='application/x-ndjson')
+  return Response(generate(), mimetype='application/x-ndjson')
 
 def get_psk(ssid, password):
   cmd = f"wpa_passphrase {shlex.quote(ssid)} {shlex.quote(password)}"
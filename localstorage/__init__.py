@@ -1,2 +1,2 @@
+from .reading import *
 from .localstorage import *
-
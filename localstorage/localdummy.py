@@ -10,6 +10,9 @@ class LocalDummy(LocalStorage):
   def deleterecord(self, record_id):
     pass
 
+  def deleterecords(self, record_ids):
+    pass
+
   def getcursor(self):
     raise NotImplementedError("No cursor can be returned because the storage dummy is not a databaase.")
 
@@ -19,7 +22,7 @@ class LocalDummy(LocalStorage):
   def deleteall(self):
     pass
 
-  def writejson(self, json_message):
+  def writereadings(self, readings):
     pass
 
   def close(self):
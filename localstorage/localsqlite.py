@@ -1,31 +1,81 @@
 import contextlib
-import json
 import os
 import sqlite3
+import threading
+import time
+import uuid
 
-from . import LocalStorage 
+from absl import logging
+from timesources import clock_offset
 
+from . import LocalStorage, Reading, StoredReadings
 
+# A wall clock step larger than this is corrected in stored rows.  NTP and chrony slew the clock
+# far more slowly than this between cycles.
+CLOCK_STEP_SEC = 2
+
+
+# A run of identical messages for one point and field.  The first is stored as an ordinary row, and
+# repeats are counted in a second row that is held back from upload and updated in place.
+class MessageRun(object):
+  __slots__ = ('text', 'row_id', 'opened')
+
+  def __init__(self, text):
+    self.text = text
+    self.row_id = None
+    self.opened = None
+
+
+# Identifies this boot, so that clock anchors are only compared within it.
+def read_boot_id():
+  try:
+    with open('/proc/sys/kernel/random/boot_id') as boot_id_file:
+      return boot_id_file.read().strip()
+  except OSError:
+    return uuid.uuid4().hex
+
+
+# Sensors on different I2C buses publish from different threads, so the connection is shared
+# between threads and every use of it is serialized.
 class LocalSqlite(LocalStorage): 
-  def __init__(self, db_path):
+  def __init__(self, db_path, message_run_flush_sec=3600):
     super().__init__()
     self.db_path = db_path
     self.db_conn = None
+    self.lock = threading.RLock()
+    self.message_run_flush_sec = message_run_flush_sec
+    # Runs of repeated messages, by (point, field).  None until this instance first writes readings.
+    self.message_runs = None
+    # The (point, field) of every message written this cycle.  A run without one this cycle has ended.
+    self.message_keys_seen = set()
+    self.boot_id = read_boot_id()
+    self.anchor_id = None
+    self.anchor_offset = None
 
   def countrecords(self):
-    with contextlib.closing(self.db_conn.cursor()) as cursor:
-      result = cursor.execute("SELECT COUNT(*) FROM data")
-      return result.fetchone()[0]
+    with self.lock:
+      with contextlib.closing(self.db_conn.cursor()) as cursor:
+        result = cursor.execute("SELECT COUNT(*) FROM data")
+        return result.fetchone()[0]
 
   def deleterecord(self, record_id):
-    with contextlib.closing(self.db_conn.cursor()) as delete_cursor:
-      delete_cursor.execute("DELETE FROM data WHERE id=?", (record_id,))
-      self.db_conn.commit()
+    with self.lock:
+      with contextlib.closing(self.db_conn.cursor()) as delete_cursor:
+        delete_cursor.execute("DELETE FROM data WHERE id=?", (record_id,))
+        self.db_conn.commit()
+
+  # Deletes several records in one transaction.
+  def deleterecords(self, record_ids):
+    with self.lock:
+      with contextlib.closing(self.db_conn.cursor()) as delete_cursor:
+        delete_cursor.executemany("DELETE FROM data WHERE id=?", ((record_id,) for record_id in record_ids))
+        self.db_conn.commit()
 
   def deleteall(self):
-    with contextlib.closing(self.db_conn.cursor()) as cursor:
-      cursor.execute("DELETE FROM data")
-      self.db_conn.commit()
+    with self.lock:
+      with contextlib.closing(self.db_conn.cursor()) as cursor:
+        cursor.execute("DELETE FROM data")
+        self.db_conn.commit()
 
   # This cursor returns all and MUST be closed by the caller.
   def getcursor(self):
@@ -34,33 +84,190 @@ class LocalSqlite(LocalStorage):
 
     return cursor
 
-  # Get the most recent num records.
+  # Get the most recent num records as StoredReadings.
+  # Rows are decoded one at a time rather than fetched all at once, so only one copy of the batch exists.
   def getrecent(self, num):
-    with contextlib.closing(self.db_conn.cursor()) as cursor:
-      cursor.execute("SELECT * FROM data ORDER BY id DESC LIMIT ?", (num,))
-      rows = cursor.fetchall()
+    stored = StoredReadings()
+    unreadable_ids = []
+    # Readings from one cycle share a timestamp, and so share one int rather than one each.
+    times = {}
+    with self.lock:
+      with contextlib.closing(self.db_conn.cursor()) as cursor:
+        for record_id, json_string, time_ns in cursor.execute("SELECT id, json, time_ns FROM data WHERE held IS NULL ORDER BY id DESC LIMIT ?", (num,)):
+          try:
+            stored.append(record_id, Reading.loads(json_string, times.setdefault(time_ns, time_ns)))
+          except ValueError as err:
+            logging.error("Dropping unreadable row {}: {}".format(record_id, str(err)))
+            unreadable_ids.append(record_id)
+
+    # Don't let a corrupt row hold up the rest of the backlog forever.
+    if unreadable_ids:
+      self.deleterecords(unreadable_ids)
 
-      return rows
+    return stored
 
-  def writejson(self, json_message):
+  # Yields every stored row as a line of NDJSON, oldest first, in the same form as is uploaded.
+  # Rows are read one at a time, so a large backlog is never all in memory at once.
+  # Like uploads, this leaves out runs of messages that are still being counted.
+  def exportndjson(self):
     with contextlib.closing(self.db_conn.cursor()) as cursor:
-      cursor.execute("INSERT INTO data (json) VALUES(?)", (json.dumps(json_message),))
-      self.db_conn.commit()
+      for record_id, json_string, time_ns in cursor.execute("SELECT id, json, time_ns FROM data WHERE held IS NULL ORDER BY id"):
+        try:
+          yield Reading.loads(json_string, time_ns).dumps() + '\n'
+        except ValueError as err:
+          # Don't let a bad row spoil the download.
+          logging.error("Skipping unreadable row {}: {}".format(record_id, str(err)))
+
+  # Writes several readings in one transaction.
+  def writereadings(self, readings):
+    with self.lock:
+      self.check_clock()
+      with contextlib.closing(self.db_conn.cursor()) as cursor:
+        self._flush_message_runs(cursor)
+        rows = []
+        for reading in readings:
+          reading.time = self._current_time(reading)
+          if (reading.message is None and reading.error is None) or not self._repeat_message(cursor, reading):
+            rows.append((reading.dumps(include_time=False), reading.time, self.anchor_id))
+        cursor.executemany("INSERT INTO data (json, time_ns, anchor) VALUES(?, ?, ?)", rows)
+        self.db_conn.commit()
+
+  # A reading stamped before the wall clock stepped, but written after, is moved by the step like the
+  # rows already stored.
+  def _current_time(self, reading):
+    if reading.time is None or reading.clock_offset is None:
+      return reading.time
+
+    step = self.anchor_offset - reading.clock_offset
+    if abs(step) <= CLOCK_STEP_SEC:
+      return reading.time
+    return reading.time + int(step * 1000000000)
+
+  # A broken sensor or a network outage writes the same message every cycle.  Rather than storing and
+  # uploading each one, repeats of the last message for a point and field are counted in a single
+  # row with first_seen (its time), last_seen and count.  That row is held back from upload until
+  # the message changes or a cycle passes without it, or for at most message_run_flush_sec, so that
+  # the server still hears about a problem that persists.
+  # Returns True if the reading was counted in a run, and False if it should be stored as usual.
+  def _repeat_message(self, cursor, reading):
+    key = (reading.point, reading.field)
+    text = (reading.message, reading.error)
+    self.message_keys_seen.add(key)
+    run = self.message_runs.get(key)
+    if run is None or run.text != text:
+      if run is not None:
+        self._release_message_run(cursor, run)
+      self.message_runs[key] = MessageRun(text)
+      return False
+
+    if run.row_id is not None:
+      cursor.execute("UPDATE data SET json = json_set(json, '$.count', json_extract(json, '$.count') + 1, '$.last_seen', ?) WHERE id = ?",
+                     (reading.time, run.row_id))
+      if cursor.rowcount:
+        return True
+
+    # The first repeat, or the run row has gone, so start a new one.
+    reading.count = 1
+    reading.last_seen = reading.time
+    cursor.execute("INSERT INTO data (json, time_ns, anchor, held) VALUES(?, ?, ?, 1)",
+                   (reading.dumps(include_time=False), reading.time, self.anchor_id))
+    run.row_id = cursor.lastrowid
+    run.opened = time.monotonic()
+    return True
+
+  def _release_message_run(self, cursor, run):
+    if run.row_id is not None:
+      cursor.execute("UPDATE data SET held = NULL WHERE id = ?", (run.row_id,))
+      run.row_id = None
+
+  def _flush_message_runs(self, cursor):
+    if self.message_runs is None:
+      # Runs held by an earlier run of the service can no longer be extended.
+      cursor.execute("UPDATE data SET held = NULL WHERE held IS NOT NULL")
+      self.message_runs = {}
+
+    now = time.monotonic()
+    for run in self.message_runs.values():
+      if run.row_id is not None and now - run.opened >= self.message_run_flush_sec:
+        self._release_message_run(cursor, run)
+
+  # Ends the runs of messages that were not repeated this cycle, so that the next one starts afresh.
+  def end_cycle(self):
+    with self.lock:
+      if self.message_runs:
+        with contextlib.closing(self.db_conn.cursor()) as cursor:
+          for key in [key for key in self.message_runs if key not in self.message_keys_seen]:
+            self._release_message_run(cursor, self.message_runs.pop(key))
+          self.db_conn.commit()
+      self.message_keys_seen.clear()
+
+  # A unit without an RTC stamps rows with the wrong time until GPS or NTP steps the clock.
+  # Every row records the clock anchor it was written under: the wall clock minus the monotonic
+  # clock, which stays constant until the wall clock is stepped.  When it steps, every unsent row
+  # written since boot is shifted by the step in a single UPDATE.
+  # This is checked every cycle and on every write.  Readings carry the clock offset they were stamped
+  # under, so one stamped before a step and written after it is corrected as it is written.
+  def check_clock(self):
+    offset = clock_offset()
+    with self.lock:
+      if self.anchor_id is not None and abs(offset - self.anchor_offset) <= CLOCK_STEP_SEC:
+        return
+
+      with contextlib.closing(self.db_conn.cursor()) as cursor:
+        if self.anchor_id is not None:
+          step = offset - self.anchor_offset
+          step_ns = int(step * 1000000000)
+          cursor.execute("UPDATE data SET time_ns = time_ns + ?, "
+                         "json = iif(json_type(json, '$.last_seen') = 'integer', json_set(json, '$.last_seen', json_extract(json, '$.last_seen') + ?), json) "
+                         "WHERE anchor IN (SELECT id FROM clock_anchors WHERE boot_id = ?)",
+                         (step_ns, step_ns, self.boot_id))
+          logging.warning("Wall clock stepped by {:.3f}s.  Corrected the time of {} stored rows.".format(step, cursor.rowcount))
+
+        cursor.execute("INSERT INTO clock_anchors (boot_id, clock_offset) VALUES(?, ?)", (self.boot_id, offset))
+        self.anchor_id = cursor.lastrowid
+        self.anchor_offset = offset
+        self.db_conn.commit()
 
   def __enter__(self):
     # There needs to actually be a place to put the data.
     os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
 
     # Create a connection.  This will be closed later in __exit__.
-    self.db_conn = sqlite3.connect(self.db_path)
+    self.db_conn = sqlite3.connect(self.db_path, check_same_thread=False)
 
     # Maybe create the table.
     with contextlib.closing(self.db_conn.cursor()) as cursor:
-      cursor.execute("CREATE TABLE IF NOT EXISTS data(id INTEGER PRIMARY KEY AUTOINCREMENT, json TEXT)")
+      cursor.execute("CREATE TABLE IF NOT EXISTS data(id INTEGER PRIMARY KEY AUTOINCREMENT, json TEXT, time_ns INTEGER, anchor INTEGER, held INTEGER)")
+      columns = [column[1] for column in cursor.execute("PRAGMA table_info(data)")]
+      if 'held' not in columns:
+        cursor.execute("ALTER TABLE data ADD COLUMN held INTEGER")
+      # Databases from before clock anchors have no anchor column.  Their rows are never corrected.
+      if 'anchor' not in columns:
+        cursor.execute("ALTER TABLE data ADD COLUMN anchor INTEGER")
+      # Databases from before integer timestamps kept an ISO 8601 time in the JSON.  It is moved to
+      # time_ns once, to the millisecond, which is as precise as SQLite's date functions go.
+      if 'time_ns' not in columns:
+        cursor.execute("ALTER TABLE data ADD COLUMN time_ns INTEGER")
+        cursor.execute("UPDATE data SET time_ns = CAST(ROUND((julianday(json_extract(json, '$.time')) - 2440587.5) * 86400000) AS INTEGER) * 1000000, "
+                       "json = json_remove(json, '$.time') WHERE json_extract(json, '$.time') IS NOT NULL")
+      cursor.execute("CREATE TABLE IF NOT EXISTS clock_anchors(id INTEGER PRIMARY KEY AUTOINCREMENT, boot_id TEXT, clock_offset REAL)")
+
+      # Anchors from earlier boots can't be compared with this boot's monotonic clock.
+      cursor.execute("DELETE FROM clock_anchors WHERE boot_id != ?", (self.boot_id,))
+      # A restarted service carries on from this boot's last anchor, so a step while it was down is still corrected.
+      anchor = cursor.execute("SELECT id, clock_offset FROM clock_anchors ORDER BY id DESC LIMIT 1").fetchone()
+      if anchor:
+        self.anchor_id, self.anchor_offset = anchor
       self.db_conn.commit()
 
     return self
 
   def __exit__(self, type, value, traceback):
     if self.db_conn:
+      if self.message_runs:
+        with self.lock:
+          with contextlib.closing(self.db_conn.cursor()) as cursor:
+            for run in self.message_runs.values():
+              self._release_message_run(cursor, run)
+            self.db_conn.commit()
       self.db_conn.close()
@@ -12,6 +12,10 @@ class LocalStorage(ABC):
   def deleterecord(self, record_id):
     pass
 
+  @abstractmethod
+  def deleterecords(self, record_ids):
+    pass
+
   @abstractmethod
   def getcursor(self):
     pass
@@ -25,7 +29,15 @@ class LocalStorage(ABC):
     pass
 
   @abstractmethod
-  def writejson(self, json_message):
+  def writereadings(self, readings):
+    pass
+
+  # Called every cycle, so that storage can correct rows stamped before a wall clock step.
+  def check_clock(self):
+    pass
+
+  # Called every cycle once its readings are written, before they are uploaded.
+  def end_cycle(self):
     pass
 
   def __enter__(self):
@@ -0,0 +1,97 @@
+import array
+import json
+import sys
+
+from timesources import format_time_ns
+
+
+# A single stored reading, from the driver that took it through local storage to the remote serializer.
+# Readings are slotted because a Pi Zero may hold tens of thousands of them while working through a backlog.
+class Reading(object):
+  __slots__ = ('point', 'field', 'value', 'message', 'error', 'time', 'clock_offset', 'burst', 'latitude', 'longitude', 'fix_quality', 'count', 'last_seen')
+
+  def __init__(self, point, field, value=None, message=None, error=None, time=None, clock_offset=None, burst=False, latitude=None, longitude=None, fix_quality=None, count=None, last_seen=None):
+    self.point = point
+    self.field = field
+    self.value = value
+    self.message = message
+    self.error = error
+    # Nanoseconds since the epoch.
+    self.time = time
+    # The time source's clock offset when the time was taken, so that local storage can tell whether
+    # the wall clock has stepped since.  It is not stored.
+    self.clock_offset = clock_offset
+    self.burst = burst
+    # Where the reading was taken, when position tagging is enabled and there is a recent GPS fix.
+    self.latitude = latitude
+    self.longitude = longitude
+    self.fix_quality = fix_quality
+    # Set on a row standing for count repeats of the same message, from time until last_seen.
+    self.count = count
+    self.last_seen = last_seen
+
+  # The JSON object sent to the SimpleAQ endpoint, which takes an ISO 8601 time.  Unset keys are left out.
+  # Local storage keeps the time in its own integer column, so it leaves the time out.
+  def to_json(self, include_time=True):
+    data_json = {'point': self.point, 'field': self.field}
+    if self.value is not None:
+      data_json['value'] = self.value
+    if self.message is not None:
+      data_json['message'] = self.message
+    if self.error is not None:
+      data_json['error'] = self.error
+    if include_time:
+      data_json['time'] = format_time_ns(self.time) if self.time is not None else None
+    if self.burst:
+      data_json['burst'] = True
+    if self.latitude is not None:
+      data_json['latitude'] = self.latitude
+      data_json['longitude'] = self.longitude
+      data_json['fix_quality'] = self.fix_quality
+    if self.count is not None:
+      data_json['count'] = self.count
+      if include_time:
+        data_json['first_seen'] = data_json['time']
+        data_json['last_seen'] = format_time_ns(self.last_seen)
+      else:
+        data_json['last_seen'] = self.last_seen
+    return data_json
+
+  def dumps(self, include_time=True):
+    return json.dumps(self.to_json(include_time))
+
+  # A backlog repeats the same few points and fields over and over, so those strings are interned
+  # and shared between readings.
+  @classmethod
+  def loads(cls, json_string, time=None):
+    data_json = json.loads(json_string)
+    return cls(
+        sys.intern(data_json.get('point') or ''),
+        sys.intern(data_json.get('field') or ''),
+        value=data_json.get('value'),
+        message=data_json.get('message'),
+        error=data_json.get('error'),
+        time=time,
+        burst=data_json.get('burst', False),
+        latitude=data_json.get('latitude'),
+        longitude=data_json.get('longitude'),
+        fix_quality=data_json.get('fix_quality'),
+        count=data_json.get('count'),
+        last_seen=data_json.get('last_seen'))
+
+
+# Readings loaded from local storage, with their row ids packed in an array so that
+# they can be deleted once uploaded.
+class StoredReadings(object):
+  __slots__ = ('ids', 'readings')
+
+  def __init__(self):
+    self.ids = array.array('q')
+    self.readings = []
+
+  def append(self, record_id, reading):
+    self.ids.append(record_id)
+    self.readings.append(reading)
+
+  def __len__(self):
+    return len(self.readings)
@@ -4,7 +4,7 @@ class DummyStorage(RemoteStorage):
   def __init__(self, endpoint=None, bucket=None, organization=None, token=None):
     super().__init__(endpoint=endpoint, bucket=bucket, organization=organization, token=token)
 
-  def write(self, data_json):
+  def write(self, readings):
     pass
 
   def __enter__(self):
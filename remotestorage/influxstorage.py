@@ -1,6 +1,6 @@
 import influxdb_client
 
-from dateutil import parser
+from influxdb_client import WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
 from . import RemoteStorage
 
@@ -9,28 +9,32 @@ class InfluxStorage(RemoteStorage):
     super().__init__(endpoint=endpoint, bucket=bucket, organization=organization, token=token)
     self.influx = None
 
-  def write(self, data_json):
+  def write(self, readings):
+    points = []
+    for reading in readings:
+      if reading.point and reading.field and reading.time:
+        fields = []
+        if reading.value is not None:
+          fields.append((reading.field, reading.value))
+        if reading.message is not None:
+          fields.append((reading.field + '-message', reading.message))
+        if reading.error is not None:
+          fields.append((reading.field + '-error', reading.error))
+
+        for field, value in fields:
+          point = influxdb_client.Point(reading.point).field(field, value).time(reading.time, WritePrecision.NS)
+          if reading.burst:
+            point = point.tag('burst', 'true')
+          # Positions are fields rather than tags, since every one is different on a moving unit.
+          # A row standing for repeats of the same message says how many, until when.
+          if reading.count is not None:
+            point = point.field('count', reading.count).field('last_seen_ns', reading.last_seen)
+          if reading.latitude is not None:
+            point = point.field('latitude', reading.latitude).field('longitude', reading.longitude).field('fix_quality', reading.fix_quality)
+          points.append(point)
+
     with self.influx.write_api(write_options=SYNCHRONOUS) as client:
-      for row in data_json:
-        if row.get('point') and row.get('field') and row.get('time'):
-          if row.get('value'):
-            client.write(
-                self.bucket,
-                self.organization, 
-                influxdb_client.Point(data_json.get('point')).field(
-                    data_json.get('field'), data_json.get('value')).time(parser.parse(data_json.get('time'))))
-          if row.get('message'):
-            client.write(
-                self.bucket,
-                self.organization,
-                influxdb_client.Point(data_json.get('point')).field(
-                    data_json.get('field') + '-message', data_json.get('message')).time(parser.parse(data_json.get('time'))))
-          if row.get('error'):
-            client.write(
-                self.bucket,
-                self.organization,
-                influxdb_client.Point(data_json.get('point')).field(
-                    data_json.get('field') + '-error', data_json.get('message')).time(parser.parse(data_json.get('time'))))
+      client.write(self.bucket, self.organization, points)
 
   def __enter__(self):
     self.influx = influxdb_client.InfluxDBClient(url=self.endpoint, token=self.token, org=self.organization)
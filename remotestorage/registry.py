@@ -0,0 +1,15 @@
+import importlib
+
+# Remote storage backends by endpoint_type.  Each one depends on its own client library,
+# so only the selected backend is imported.
+REMOTE_STORAGE = {
+    'INFLUXDB': 'remotestorage.influxstorage:InfluxStorage',
+    'SIMPLEAQ': 'remotestorage.simpleaqstorage:SimpleAQStorage',
+}
+
+
+# Returns the remote storage class for an endpoint_type, importing its module on first use.
+# Anything other than INFLUXDB uses the SimpleAQ endpoint.
+def load_remote_storage(endpoint_type):
+  module_name, class_name = REMOTE_STORAGE.get(endpoint_type, REMOTE_STORAGE['SIMPLEAQ']).split(':')
+  return getattr(importlib.import_module(module_name), class_name)
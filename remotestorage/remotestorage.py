@@ -7,8 +7,9 @@ class RemoteStorage(ABC):
     self.organization = organization
     self.token = token
 
+  # Writes a list of localstorage.Reading.
   @abstractmethod
-  def write(self):
+  def write(self, readings):
     pass
 
   def __enter__(self):
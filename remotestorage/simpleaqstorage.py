@@ -1,17 +1,15 @@
-import json
 import requests
 from requests_toolbelt import MultipartEncoder
 from absl import logging
-from dateutil import parser
 from . import RemoteStorage
 
 class SimpleAQStorage(RemoteStorage): 
   def __init__(self, endpoint=None, bucket=None, organization=None, token=None):
     super().__init__(endpoint=endpoint, bucket=bucket, organization=organization, token=token)
 
-  def write(self, data_json):
-    # Convert the list of JSON objects to an NDJSON string
-    ndjson_data = "\n".join(obj for obj in data_json)
+  def write(self, readings):
+    # Convert the list of readings to an NDJSON string
+    ndjson_data = "\n".join(reading.dumps() for reading in readings)
 
     # Prepare the multipart encoder
     encoder = MultipartEncoder(
@@ -2,34 +2,31 @@
 
 import contextlib
 import datetime
-import json
 import os
 import time
-import RPi.GPIO as GPIO
-import subprocess
 
 from absl import app, flags, logging
 
 import dotenv
 
 from devices.system import System
-from devices.bme688 import Bme688
-from devices.bmp3xx import Bmp3xx
-from devices.gps import Gps
-from devices.pm25 import Pm25
-from devices.sen5x import Sen5x
-from devices.dfrobot_multigassensor import DFRobotMultiGas00 
-from devices.dfrobot_multigassensor import DFRobotMultiGas01
-from devices.dfrobot_multigassensor import DFRobotMultiGas10
-from devices.dfrobot_multigassensor import DFRobotMultiGas11
-from devices.pcbartists_decibel import PCBArtistsDecibel 
-from devices.uartnmeagps import UartNmeaGps
+from devices.sensor import ReadingBatch
+from devices.registry import DEVICE_DRIVERS, load_driver
+from devices.i2cbus import I2cBus, check_clock
+from devices.burst import BurstController, parse_burst_triggers, publish_bursting_sensors
+from devices.deadband import DeadbandFilter, parse_deadbands
+from devices.health import SensorHealth, publish_with_health
+from devices.positiontrack import PositionTrack
+from devices.workers import BusWorkers
+from devices.diagnostics import DiagnosticsCollector
+from devices.detection import DEVICE_ADDRESSES, DetectionRevalidator, HotplugScanner, candidate_groups, probe_candidates, sweep_addresses
+from devices.detection import device_key, split_device_key
+from devices.detection import clear_detection_cache, load_detection_cache, save_detection_cache
 
 from localstorage.localdummy import LocalDummy
 from localstorage.localsqlite import LocalSqlite 
 from remotestorage.dummystorage import DummyStorage
-from remotestorage.influxstorage import InfluxStorage
-from remotestorage.simpleaqstorage import SimpleAQStorage
+from remotestorage.registry import load_remote_storage
 
 from timesources.systemtimesource import SystemTimeSource
 from timesources.synctimesource import SyncTimeSource
@@ -45,46 +42,11 @@ def do_graceful_reboot():
     return True
   return False
 
-# Enumerate the list of supported devices here.
-device_map = {
-    'system': System,
-    'bme688': Bme688,
-    'bmp3xx': Bmp3xx,
-    'uartnmeagps': UartNmeaGps,
-    'gps': Gps,
-    'pm25': Pm25,
-    'sen5x': Sen5x,
-    'dfrobotmultigas00': DFRobotMultiGas00,
-    'dfrobotmultigas01': DFRobotMultiGas01,
-    'dfrobotmultigas10': DFRobotMultiGas10,
-    'dfrobotmultigas11': DFRobotMultiGas11,
-    'pcbartistsdecibel': PCBArtistsDecibel
-}
-
+# The list of supported devices is in devices/registry.py.
 priority_devices = ['gps', 'dfrobotgps', 'uartnmeagps']
 
-# Find the set of devices that are installed in this system.
-def detect_devices(env_file):
-  detected_devices = set()
-  test_timesource = SystemTimeSource()
-
-  # Figure out what devices are connected.
-  with contextlib.closing(LocalDummy()) as local_storage:
-    with DummyStorage() as remote_storage:
-      with LinuxI2cTransceiver(os.getenv('i2c_bus')) as i2c_transceiver:
-        for name, device in device_map.items():
-          device_object = None
-          try:
-            device_object = device(remotestorage=remote_storage, localstorage=local_storage, i2c_transceiver=i2c_transceiver, timesource=test_timesource, env_file=env_file, log_errors=False)
-            device_object.publish()
-            detected_devices.add(name)
-            logging.info("Detected device: {}".format(name))
-          except Exception:
-            logging.info("Device not detected: {}".format(name))
-          finally:
-            if device_object:
-              del device_object
-
+# Saves the set of installed devices, so that the hostap config service can show them.
+def record_detected_devices(env_file, detected_devices):
   # Get the existing devices
   current_devices = set(os.getenv('detected_devices').split(','))
 
@@ -101,35 +63,115 @@ def detect_devices(env_file):
     # Restart the hostap service so that it reads correctly.
     os.system('systemctl restart {}'.format(os.getenv('hostap_config_service')))
 
-  # Let's make sure that if any priority devices were detected, they are listed first.
-  device_objects = []
+# Whether a device is installed: its driver can be constructed and can publish, here to dummy storage.
+def probe_device(key, buses, remote_storage, local_storage, timesource, env_file):
+  name, bus_label = split_device_key(key)
+  device_object = None
+  try:
+    device_object = load_driver(name)(remotestorage=remote_storage, localstorage=local_storage, i2c_transceiver=buses[bus_label], timesource=timesource, env_file=env_file, log_errors=False)
+    device_object.publish()
+    logging.info("Detected device: {}".format(key))
+    return True
+  except Exception:
+    logging.info("Device not detected: {}".format(key))
+    return False
+  finally:
+    if device_object:
+      del device_object
 
-  for priority_device in priority_devices:
-    if priority_device in detected_devices:
-      device_objects.append(device_map[priority_device])
-      detected_devices.remove(priority_device)
+# Find the set of devices that are installed in this system.
+# Rather than constructing every driver in turn, we sweep the bus once and only try the drivers whose
+# address answered, plus those not on I2C, all in parallel.
+# Returns the names of the devices to use, and how long detection took.
+def detect_devices(env_file):
+  test_timesource = SystemTimeSource()
+  start_time = time.monotonic()
 
-  # Ok, add the rest.
-  for device in detected_devices:
-   device_objects.append(device_map[device])
+  # Figure out what devices are connected.
+  with contextlib.closing(LocalDummy()) as local_storage:
+    with DummyStorage() as remote_storage:
+      with contextlib.ExitStack() as bus_stack:
+        buses = open_i2c_buses(bus_stack)
 
-  return device_objects
+        def try_device(key):
+          return probe_device(key, buses, remote_storage, local_storage, test_timesource, env_file)
 
+        # Devices not on I2C are only tried once.
+        groups = [[name] for name in DEVICE_DRIVERS if name not in DEVICE_ADDRESSES]
+        for bus_label, bus in buses.items():
+          answering = sweep_addresses(bus)
+          logging.info("I2C addresses answering on {}: {}".format(bus_label or 'the primary bus', ', '.join('0x{:02X}'.format(address) for address in sorted(answering))))
+          groups += [[device_key(name, bus_label) for name in group] for group in candidate_groups(answering)]
 
-def attempt_reset_i2c_bus(bus_number):
-  # Attempt to detect bus stuckness.
-  logging.info("Checking for stuck bus condition.")
+        detected_devices = probe_candidates(groups, try_device)
 
-  start_time = time.time()
-  os.system('i2cdetect -y {}'.format(bus_number))
-  end_time = time.time()
+  detection_time = time.monotonic() - start_time
+  logging.info("Detected {} devices in {:.1f}s.".format(len(detected_devices), detection_time))
 
-  # This generally completes almost immediately.  
-  # If it took longer than a second, we should try resetting.
-  if end_time - start_time > 1:
-    logging.info("The I2C bus appears to be stuck.  Device should be power cycled.")
-    return True
-  return False
+  record_detected_devices(env_file, detected_devices)
+
+  return order_devices(detected_devices), detection_time
+
+# Let's make sure that if any priority devices were detected, they are listed first.
+def order_devices(detected_devices):
+  detected_devices = set(detected_devices)
+  device_names = []
+
+  for priority_device in priority_devices:
+    if priority_device in detected_devices:
+      device_names.append(priority_device)
+      detected_devices.remove(priority_device)
+
+  # Ok, add the rest.
+  for device in detected_devices:
+   device_names.append(device)
+
+  return device_names
+
+
+# Wraps a transceiver in the bus manager, which recovers the bus on its own if it gets stuck.
+# scl_gpio_pin and sda_gpio_pin belong to the primary bus, so only it can be recovered.
+def make_i2c_bus(linux_i2c_transceiver, primary):
+  return I2cBus(linux_i2c_transceiver,
+                int(os.getenv('i2c_clock_hz', '100000')),
+                scl_pin=int(os.getenv('scl_gpio_pin')) if primary and os.getenv('scl_gpio_pin') else None,
+                sda_pin=int(os.getenv('sda_gpio_pin')) if primary and os.getenv('sda_gpio_pin') else None,
+                recovery_threshold=int(os.getenv('i2c_recovery_after_timeouts', '3')))
+
+# Opens every I2C bus in i2c_buses, or just i2c_bus, and returns their bus managers by label.
+# The first bus is the primary bus, labelled None.  The others are labelled by device, e.g. i2c-3.
+def open_i2c_buses(stack):
+  buses = {}
+  for index, bus_device in enumerate((os.getenv('i2c_buses') or os.getenv('i2c_bus')).split(',')):
+    bus_device = bus_device.strip()
+    linux_i2c_transceiver = stack.enter_context(LinuxI2cTransceiver(bus_device))
+    buses[os.path.basename(bus_device) if index else None] = make_i2c_bus(linux_i2c_transceiver, index == 0)
+  return buses
+
+# Sleep until the next cycle.  In the meantime, oversampled sensors are read every oversample_interval
+# seconds and sensors in a burst are published every burst interval.
+def wait_for_next_cycle(sensors, workers, interval, oversample_interval, timesource, burst_controller):
+  oversampled_sensors = [sensor for sensor in sensors if sensor.oversampler is not None]
+
+  now = time.monotonic()
+  next_cycle = now + interval
+  next_sample = now + oversample_interval if oversample_interval and oversampled_sensors else None
+  next_burst = now + burst_controller.interval if burst_controller else None
+
+  while True:
+    next_event = min(event for event in [next_cycle, next_sample, next_burst] if event is not None)
+    time.sleep(max(0, next_event - time.monotonic()))
+
+    if next_event >= next_cycle:
+      return
+
+    if next_sample is not None and next_sample <= next_event:
+      workers.map(lambda sensor: sensor.sample(), oversampled_sensors)
+      next_sample += oversample_interval
+
+    if next_burst is not None and next_burst <= next_event:
+      publish_bursting_sensors(sensors, workers, timesource, burst_controller)
+      next_burst += burst_controller.interval
 
 # This program loads environment variables only on boot.
 # If the environment variables change for any reason, the systemd service
@@ -142,123 +184,225 @@ def main(args):
   else:
     dotenv.load_dotenv()
 
-  # Attempt to avoid rare I2C bus error.
-  i2c_bus_stuck = False
-  if os.getenv('i2c_bus_number'):
-    i2c_bus_stuck = attempt_reset_i2c_bus(int(os.getenv('i2c_bus_number')))
-
-  device_objects = detect_devices(FLAGS.env)
+  # On a warm boot, the devices bound last time are bound again straight away, and checked in the background.
+  detection_cache_path = os.getenv('detection_cache_path')
+  cached_devices = load_detection_cache(detection_cache_path)
+  if cached_devices:
+    logging.info("Binding cached devices: {}".format(', '.join(cached_devices)))
+    device_names = order_devices(key for key in cached_devices if split_device_key(key)[0] in DEVICE_DRIVERS)
+    detection_time = None
+  else:
+    device_names, detection_time = detect_devices(FLAGS.env)
 
-  remote_storage_class = None
+  # Only the selected backend's client library is imported.
+  remote_storage_class = load_remote_storage(os.getenv('endpoint_type'))
   timesource = None
   send_last_known_gps = False
   if os.getenv('endpoint_type') == 'INFLUXDB':
-    remote_storage_class = InfluxStorage
     timesource = SystemTimeSource()
     send_last_known_gps = False
   else:
-    remote_storage_class = SimpleAQStorage
     timesource = SyncTimeSource()
     send_last_known_gps = True
 
   # This implicitly creates the database.
-  with LocalSqlite(os.getenv("sqlite_db_path")) as local_storage:
+  with LocalSqlite(os.getenv("sqlite_db_path"), float(os.getenv('message_run_flush_sec', '3600'))) as local_storage:
 
     interval = int(os.getenv('simpleaq_interval'))
+    oversample_interval = float(os.getenv('oversample_interval_sec')) if os.getenv('oversample_interval_sec') else None
+
+    burst_controller = None
+    burst_triggers = parse_burst_triggers(os.getenv('burst_triggers'))
+    if burst_triggers:
+      burst_controller = BurstController(
+          burst_triggers,
+          float(os.getenv('burst_interval_sec', '5')),
+          float(os.getenv('burst_duration_sec', '120')),
+          int(os.getenv('burst_max_samples_per_hour', '240')))
+
+    deadband_filter = None
+    deadbands = parse_deadbands(os.getenv('deadband_fields'))
+    if deadbands:
+      deadband_filter = DeadbandFilter(deadbands, float(os.getenv('deadband_heartbeat_sec', '900')))
+
+    # On mobile units every reading can carry where it was taken, interpolated from the GPS track,
+    # so the server does not have to join each reading to the GPS rows by time.
+    position_track = None
+    if os.getenv('position_tagging', 'false').lower() == 'true':
+      position_track = PositionTrack(float(os.getenv('position_tagging_max_age_sec', '10')))
 
     with remote_storage_class(endpoint=os.getenv('influx_server'), organization=os.getenv('influx_org'), bucket=os.getenv('influx_bucket'), token=os.getenv('influx_token')) as remote:
-      with LinuxI2cTransceiver(os.getenv('i2c_bus')) as i2c_transceiver:
-        sensors = []
-
-        for device_object in device_objects:
+      with contextlib.ExitStack() as bus_stack:
+        # Every driver goes through its bus's manager, which serializes and counts all access to that bus.
+        buses = open_i2c_buses(bus_stack)
+        for bus in buses.values():
+          check_clock(bus.description, bus.clock_hz)
+        bound_sensors = {}
+
+        def make_sensor(key):
+          name, bus_label = split_device_key(key)
+          sensor = load_driver(name)(remotestorage=remote,
+                                 localstorage=local_storage,
+                                 timesource=timesource,
+                                 interval=interval,
+                                 oversample_interval=oversample_interval,
+                                 burst_controller=burst_controller,
+                                 deadband_filter=deadband_filter,
+                                 position_track=position_track,
+                                 i2c_transceiver=buses[bus_label],
+                                 i2c_buses=buses,
+                                 log_errors=True,
+                                 env_file=FLAGS.env,
+                                 send_last_known_gps=send_last_known_gps)
+
+          if bus_label:
+            sensor.point_suffix = '@' + bus_label
+            sensor.name += sensor.point_suffix
+
+          # A sensor that keeps failing is quarantined, so that it does not slow down the cycle for the healthy ones.
+          sensor.health = SensorHealth(sensor.name,
+                                       int(os.getenv('quarantine_after_failures', '3')),
+                                       float(os.getenv('quarantine_backoff_sec', '60')),
+                                       float(os.getenv('quarantine_max_backoff_sec', '3600')))
+          return sensor
+
+        for key in device_names:
           try:
-            sensor = device_object(remotestorage=remote,
-                                   localstorage=local_storage,
-                                   timesource=timesource,
-                                   interval=interval,
-                                   i2c_transceiver=i2c_transceiver,
-                                   log_errors=True,
-                                   env_file=FLAGS.env,
-                                   send_last_known_gps=send_last_known_gps)
-            sensors.append(sensor)
+            bound_sensors[key] = make_sensor(key)
           except Exception as err:
             logging.error("Failure initializing detected device: {}".format(str(err)))
+            if cached_devices:
+              # The cache is out of date, so do a full detection when we restart.
+              clear_detection_cache(detection_cache_path)
             logging.warning("SimpleAQ service will restart now.")
             return 1
 
+        sensors = list(bound_sensors.values())
+
+        # Devices plugged in while we are running are picked up by a background rescan of the unused addresses on each bus.
+        hotplug_scanners = {}
+        if float(os.getenv('hotplug_scan_interval_sec', '60')) > 0:
+          for bus_label, bus in buses.items():
+            hotplug_scanners[bus_label] = HotplugScanner(
+                bus,
+                [name for name, label in map(split_device_key, bound_sensors) if label == bus_label],
+                lambda name, bus_label=bus_label: make_sensor(device_key(name, bus_label)),
+                float(os.getenv('hotplug_scan_interval_sec', '60')))
+
+        revalidator = None
+        first_cycle = True
+
         last_write_succeeded = True
 
         # This enteres a guaranteed-closing context manager for every sensors.
         # The Sen5X, for instance, requires that start_measurement is started at the beginning of a run and exited at the end.
         # Most of the others are no-ops.
         with contextlib.ExitStack() as stack:
+          # Sensors on different buses are published in parallel, one worker per bus.
+          workers = stack.enter_context(BusWorkers())
+
           for sensor in sensors:
             stack.enter_context(sensor)
 
+          for hotplug_scanner in hotplug_scanners.values():
+            stack.enter_context(hotplug_scanner)
+
+          def write_diagnostics(bundle):
+            batch = ReadingBatch('System')
+            batch.add_error('diagnostics', bundle)
+            return System(remotestorage=remote, localstorage=local_storage, timesource=timesource, log_errors=True)._write_batch(batch)
+
+          diagnostics = stack.enter_context(DiagnosticsCollector(
+              write_diagnostics,
+              float(os.getenv('diagnostics_min_interval_sec', '900')),
+              int(os.getenv('diagnostics_lines', '100')),
+              int(os.getenv('diagnostics_since_min', '60'))))
+
           do_reboot = False
           while not do_reboot:
+            local_storage.check_clock()
             timesource.set_time(datetime.datetime.now())
-            result_failure = [sensor.publish() for sensor in sensors]
+            for bus_label, hotplug_scanner in hotplug_scanners.items():
+              new_sensors = hotplug_scanner.take_new_sensors()
+              for name, sensor in new_sensors:
+                stack.enter_context(sensor)
+                sensors.append(sensor)
+                bound_sensors[device_key(name, bus_label)] = sensor
+
+              if new_sensors:
+                record_detected_devices(FLAGS.env, set(bound_sensors))
+                save_detection_cache(detection_cache_path, bound_sensors)
+
+            result_failure = workers.map(publish_with_health, sensors)
+
+            # Detection delays the first sample after power-up, so report how long it took.
+            if detection_time is not None:
+              system_device = System(remotestorage=remote, localstorage=local_storage, timesource=timesource, log_errors=True)
+              system_device._try_write("System", "device_detection_sec", detection_time)
+              detection_time = None
+
+            # Some fingerprints, such as the DFRobot gas type, are only known after the first reading.
+            if first_cycle:
+              if cached_devices:
+                revalidator = DetectionRevalidator(
+                    buses, cached_devices, bound_sensors,
+                    lambda key: probe_device(key, buses, DummyStorage(), LocalDummy(), SystemTimeSource(), FLAGS.env),
+                    hotplug=bool(hotplug_scanners))
+                revalidator.start()
+              else:
+                save_detection_cache(detection_cache_path, bound_sensors)
+              first_cycle = False
+
+            if revalidator and revalidator.mismatches is not None:
+              if revalidator.mismatches:
+                logging.warning("Installed devices do not match the detection cache: {}".format('; '.join(revalidator.mismatches)))
+                clear_detection_cache(detection_cache_path)
+                logging.warning("SimpleAQ service will restart now.")
+                return 1
+
+              logging.info("Cached devices revalidated.")
+              save_detection_cache(detection_cache_path, bound_sensors)
+              revalidator = None
 
             if any(result_failure):
               # We only report errors, we do not take the entire unit offline if a few things are malfunctioning.
               # Errors will continue to be logged and saved.
               system_device = System(remotestorage=remote, localstorage=local_storage, timesource=timesource, log_errors=True) 
-              system_device._try_write("System", "error", "Devices reported errors: " + ','.join([r for r in result_failure if r]))
-            elif i2c_bus_stuck:
+              system_device._try_write_error("System", "error", "Devices reported errors: " + ','.join([r for r in result_failure if r]))
+            elif any(bus.stuck for bus in buses.values()):
               system_device = System(remotestorage=remote, localstorage=local_storage, timesource=timesource, log_errors=True)
-              system_device._try_write("System", "error", "I2C bus stuckness was detected, and this device should be unplugged and plugged back in again.")
+              system_device._try_write_error("System", "error", "I2C bus stuckness was detected and could not be recovered, and this device should be unplugged and plugged back in again.")
+
+            local_storage.end_cycle()
 
             # All data is written exclusively from local storage.
             logging.info("Getting rows from local storage")
-            publish_rows = local_storage.getrecent(int(os.getenv("max_backlog_writes")))
-            data_json = [row[1] for row in publish_rows]
+            stored_readings = local_storage.getrecent(int(os.getenv("max_backlog_writes")))
 
-            logging.info("Attempting to write {} data points to remote.".format(len(data_json)))
+            logging.info("Attempting to write {} data points to remote.".format(len(stored_readings)))
             # We'll try to write them in one single batch.
-            if data_json:
+            if stored_readings:
               try:
-                remote.write(data_json)
+                remote.write(stored_readings.readings)
  
                 # We succeeded in writing the data.  Let's delete it from our local cache.
                 logging.info("Deleting written rows.")
-                for row in publish_rows:
-                  local_storage.deleterecord(row[0])
+                local_storage.deleterecords(stored_readings.ids)
+                last_write_succeeded = True
               except Exception as err:
                 logging.error("Failed to write data to remote: {}".format(str(err)))
 
+                # Logs explaining the first failure of an outage are collected in the background, and
+                # uploaded with everything else once the connection is back.
                 if last_write_succeeded:
-                    # Let's get a system device and write any useful logging information.
-                    # Obviously this won't immediately succeed, but we can later help users debug errors.
-                    system_device = System(remotestorage=remote, localstorage=local_storage, timesource=timesource, log_errors=True)
-
-                    try:
-                      dmesg_result = subprocess.run(['dmesg | tail -n 100'], shell=True, stdout=subprocess.PIPE)
-                      dmesg_string = dmesg_result.stdout.decode('utf-8')
-
-                      simpleaq_result = subprocess.run(['journalctl -u simpleaq.service | tail -n 100'], shell=True, stdout=subprocess.PIPE)
-                      simpleaq_string = simpleaq_result.stdout.decode('utf-8')
-
-                      networkmanager_result = subprocess.run(['journalctl -u NetworkManager | tail -n 100'], shell=True, stdout=subprocess.PIPE)
-                      networkmanager_string = networkmanager_result.stdout.decode('utf-8')
-
-                      hostap_result = subprocess.run(['journalctl -u hostap_config.service | tail -n 100'], shell=True, stdout=subprocess.PIPE)
-                      hostap_string = hostap_result.stdout.decode('utf-8')
-
-                      system_device._try_write("System", "error", "dmesg logs: \n" + dmesg_string +
-                                                                  "\n simpleaq logs: \n" + simpleaq_string +
-                                                                  "\n networkmanager logs: \n" + networkmanager_string +
-                                                                  "\n hostap logs: \n" + hostap_string)
-                    except Exception:
-                      logging.error("Failed to write error logs: {}".format(str(err)))
-
-                    last_write_succeeded = False
+                  diagnostics.request()
+                  last_write_succeeded = False
 
             else:
               logging.info("No data to write!")
 
             # TODO:  We should probably wait until a specific future time,  instead of sleep.
-            time.sleep(interval)
+            wait_for_next_cycle(sensors, workers, interval, oversample_interval, timesource, burst_controller)
 
             # We attempt to reboot gracefully, at a time when we've released all of the buses,
             # to prevent inadvertently causing bus stuckness.
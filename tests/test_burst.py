@@ -0,0 +1,101 @@
+import datetime
+import unittest
+
+from devices import ReadingBatch, Sensor
+from devices.burst import publish_burst_sample
+from devices.pcbartists_decibel import PCBArtistsDecibel
+from localstorage.localdummy import LocalDummy
+from timesources.synctimesource import SyncTimeSource
+
+
+# Keeps every reading written, in order.
+class RecordingStorage(LocalDummy):
+  def __init__(self):
+    super().__init__()
+    self.readings = []
+
+  def writereadings(self, readings):
+    self.readings.extend(readings)
+
+
+class FakeOversampledSensor(Sensor):
+  def __init__(self, localstorage, timesource, values):
+    super().__init__(None, localstorage, timesource, interval=60, oversample_interval=10)
+    self.name = 'Fake'
+    self.values = iter(values)
+    self._enable_oversampling(['level'])
+
+  def read_sample(self):
+    return {'level': next(self.values)}
+
+  def publish(self):
+    batch = ReadingBatch('Fake')
+    self.oversampler.add(self.read_sample())
+    self._add_oversampled(batch)
+    return self._write_batch(batch)
+
+
+# Answers every decibel register read with the next level.
+class FakeDecibelTransceiver(object):
+  STATUS_OK = 0
+
+  def __init__(self, levels):
+    self.levels = iter(levels)
+
+  def transceive(self, address, tx_data, rx_length, read_delay=0, timeout=0):
+    if not rx_length:
+      return self.STATUS_OK, None, None
+    return self.STATUS_OK, None, bytes([next(self.levels)])
+
+
+def regular_readings(storage):
+  return {reading.field: reading.value for reading in storage.readings if not reading.burst}
+
+
+class BurstTest(unittest.TestCase):
+  def setUp(self):
+    self.timesource = SyncTimeSource()
+    self.timesource.set_time(datetime.datetime.now())
+
+  def test_burst_does_not_change_oversampled_statistics(self):
+    # The burst takes the second value, so both runs oversample the same values.
+    without_burst = RecordingStorage()
+    sensor = FakeOversampledSensor(without_burst, self.timesource, [1, 2, 4])
+    sensor.sample()
+    sensor.sample()
+    sensor.publish()
+
+    with_burst = RecordingStorage()
+    sensor = FakeOversampledSensor(with_burst, self.timesource, [1, 9, 2, 4])
+    sensor.sample()
+    self.assertFalse(publish_burst_sample(sensor))
+    sensor.sample()
+    sensor.publish()
+
+    self.assertEqual(regular_readings(without_burst), regular_readings(with_burst))
+    self.assertEqual(regular_readings(with_burst)['level_count'], 3)
+    self.assertEqual([(reading.field, reading.value) for reading in with_burst.readings if reading.burst], [('level', 9.0)])
+
+  def test_burst_does_not_take_sampled_levels(self):
+    without_burst = RecordingStorage()
+    # The first level is read while the driver checks that the meter is there.
+    sensor = PCBArtistsDecibel(None, without_burst, self.timesource, FakeDecibelTransceiver([50, 60, 70, 80]), interval=60)
+    for _ in range(3):
+      sensor._sample_level()
+    sensor.publish()
+
+    with_burst = RecordingStorage()
+    sensor = PCBArtistsDecibel(None, with_burst, self.timesource, FakeDecibelTransceiver([50, 60, 70, 90, 80]), interval=60)
+    sensor._sample_level()
+    sensor._sample_level()
+    self.assertFalse(publish_burst_sample(sensor))
+    sensor._sample_level()
+    sensor.publish()
+
+    self.assertEqual(regular_readings(without_burst), regular_readings(with_burst))
+    self.assertEqual(regular_readings(with_burst)['sound_sample_count'], 3.0)
+    self.assertEqual([(reading.field, reading.value) for reading in with_burst.readings if reading.burst], [('sound_level_dB', 90.0)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from devices.deadband import DeadbandFilter, parse_deadbands
+
+
+class DeadbandFilterTest(unittest.TestCase):
+  def setUp(self):
+    self.deadband_filter = DeadbandFilter(parse_deadbands('BMP3XX/pressure_hPa:0.1;SEN5X/pm2.5_ug_m3:5%'), heartbeat=3600)
+
+  def test_values_within_tolerance_are_suppressed(self):
+    self.assertTrue(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', 1000.0))
+    self.assertFalse(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', 1000.05))
+    self.assertTrue(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', 1000.2))
+
+  def test_relative_tolerance(self):
+    self.assertTrue(self.deadband_filter.should_write('SEN5X', 'pm2.5_ug_m3', 20))
+    self.assertFalse(self.deadband_filter.should_write('SEN5X', 'pm2.5_ug_m3', 20.9))
+    self.assertTrue(self.deadband_filter.should_write('SEN5X', 'pm2.5_ug_m3', 21.1))
+
+  def test_none_and_non_numeric_values_pass_through(self):
+    self.assertTrue(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', None))
+    self.assertTrue(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', 1000.0))
+    self.assertTrue(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', None))
+    self.assertTrue(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', 'unavailable'))
+    self.assertTrue(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', [1000.0]))
+
+    # They don't replace the last value written.
+    self.assertFalse(self.deadband_filter.should_write('BMP3XX', 'pressure_hPa', 1000.05))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from devices.detection import DetectionRevalidator
+
+
+# A bus on which only the given addresses answer.
+class FakeBus(object):
+  STATUS_OK = 0
+  STATUS_NACK = 1
+
+  def __init__(self, addresses):
+    self.addresses = addresses
+
+  def transceive(self, address, tx_data, rx_length, read_delay=0, timeout=0):
+    return (self.STATUS_OK, None, None) if address in self.addresses else (self.STATUS_NACK, 'NACK', None)
+
+
+class FakeSensor(object):
+  def fingerprint(self):
+    return {}
+
+
+def revalidate(answering, bound, installed, hotplug=False):
+  revalidator = DetectionRevalidator({None: FakeBus(answering)}, {key: {} for key in bound},
+                                     {key: FakeSensor() for key in bound}, lambda key: key in installed, hotplug)
+  revalidator._run()
+  return revalidator.mismatches
+
+
+class DetectionRevalidatorTest(unittest.TestCase):
+  def test_cached_devices_match(self):
+    self.assertEqual(revalidate({0x69}, ['system', 'sen5x'], {'system', 'sen5x'}), [])
+
+  def test_device_installed_while_off_is_a_mismatch(self):
+    self.assertEqual(revalidate({0x69, 0x12}, ['system', 'sen5x'], {'system', 'sen5x', 'pm25'}),
+                     ['pm25 is installed but not bound'])
+
+  def test_unknown_device_on_an_address_is_not_a_mismatch(self):
+    self.assertEqual(revalidate({0x69, 0x12}, ['system', 'sen5x'], {'system', 'sen5x'}), [])
+
+  def test_driver_not_on_i2c_installed_while_off_is_a_mismatch(self):
+    self.assertEqual(revalidate({0x69}, ['system', 'sen5x'], {'system', 'sen5x', 'uartnmeagps'}),
+                     ['uartnmeagps is installed but not bound'])
+
+  def test_hotplug_finds_new_i2c_devices_instead(self):
+    self.assertEqual(revalidate({0x69, 0x12}, ['system', 'sen5x'], {'system', 'sen5x', 'pm25'}, hotplug=True), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from devices import Sensor
+from devices.health import SensorHealth, publish_with_health
+from devices.poller import Poller
+
+
+# Fails while broken is set, and polls in the background like the streaming drivers.
+class FlakySensor(Sensor):
+  def __init__(self):
+    super().__init__(None, None, None)
+    self.name = 'Flaky'
+    self.broken = False
+    self.poller = Poller(self.name, lambda: None, 60)
+
+  def publish(self):
+    return self.name if self.broken else False
+
+
+class PublishWithHealthTest(unittest.TestCase):
+  def setUp(self):
+    self.sensor = FlakySensor()
+    # No backoff, so that the quarantined sensor is retried every cycle.
+    self.sensor.health = SensorHealth(self.sensor.name, failure_threshold=2, base_backoff=0, max_backoff=0)
+    self.sensor.poller.start()
+
+  def tearDown(self):
+    self.sensor.poller.stop()
+
+  def test_quarantine_pauses_poller_until_reinstated(self):
+    self.sensor.broken = True
+    publish_with_health(self.sensor)
+    self.assertIsNotNone(self.sensor.poller.thread)
+
+    publish_with_health(self.sensor)
+    self.assertTrue(self.sensor.health.quarantined)
+    self.assertIsNone(self.sensor.poller.thread)
+
+    publish_with_health(self.sensor)
+    self.assertIsNone(self.sensor.poller.thread)
+
+    self.sensor.broken = False
+    self.assertFalse(publish_with_health(self.sensor))
+    self.assertFalse(self.sensor.health.quarantined)
+    self.assertTrue(self.sensor.poller.thread.is_alive())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,139 @@
+import datetime
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from devices import Sensor
+from devices.system import System
+from localstorage import Reading
+from localstorage.localsqlite import LocalSqlite
+from timesources.synctimesource import SyncTimeSource
+
+
+class MessageRunTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.storage = LocalSqlite(os.path.join(self.directory.name, 'data.db')).__enter__()
+
+  def tearDown(self):
+    self.storage.__exit__(None, None, None)
+    self.directory.cleanup()
+
+  # One cycle of the main loop, writing the given messages for GPS/error.
+  def cycle(self, *messages):
+    self.storage.writereadings([Reading('GPS', 'error', message=message, time=time.time_ns()) for message in messages])
+    self.storage.end_cycle()
+
+  # (message, count, held) for every stored row, oldest first.
+  def rows(self):
+    with self.storage.db_conn:
+      return self.storage.db_conn.execute(
+          "SELECT json_extract(json, '$.message'), json_extract(json, '$.count'), held FROM data ORDER BY id").fetchall()
+
+  def test_repeats_are_counted_in_one_held_row(self):
+    self.cycle('No fix')
+    self.cycle('No fix')
+    self.cycle('No fix')
+
+    self.assertEqual(self.rows(), [('No fix', None, None), ('No fix', 2, 1)])
+
+  def test_cycle_without_message_ends_run(self):
+    self.cycle('No fix')
+    self.cycle('No fix')
+    self.cycle()
+    self.cycle('No fix')
+
+    # The run is released when the message stops, and its return is stored as a new message.
+    self.assertEqual(self.rows(), [('No fix', None, None), ('No fix', 1, None), ('No fix', None, None)])
+
+  def test_message_no_message_message(self):
+    self.cycle('No fix')
+    self.cycle()
+    self.cycle('No fix')
+
+    self.assertEqual(self.rows(), [('No fix', None, None), ('No fix', None, None)])
+
+  # As the main loop reports devices that keep failing.
+  def test_repeated_system_errors_are_counted(self):
+    timesource = SyncTimeSource()
+    for _ in range(4):
+      timesource.set_time(datetime.datetime.now())
+      System(None, self.storage, timesource, log_errors=True)._try_write_error('System', 'error', 'Devices reported errors: GPS')
+      self.storage.end_cycle()
+
+    with self.storage.db_conn:
+      rows = self.storage.db_conn.execute("SELECT json_extract(json, '$.error'), json_extract(json, '$.count'), held FROM data ORDER BY id").fetchall()
+    self.assertEqual(rows, [('Devices reported errors: GPS', None, None), ('Devices reported errors: GPS', 3, 1)])
+
+
+class ExportTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.storage = LocalSqlite(os.path.join(self.directory.name, 'data.db')).__enter__()
+
+  def tearDown(self):
+    self.storage.__exit__(None, None, None)
+    self.directory.cleanup()
+
+  def test_exported_rows_have_time(self):
+    self.storage.writereadings([Reading('BMP3XX', 'pressure_hPa', value=1000.0, time=1700000000123000000)])
+
+    lines = list(self.storage.exportndjson())
+
+    self.assertEqual(len(lines), 1)
+    self.assertEqual(json.loads(lines[0]), {'point': 'BMP3XX', 'field': 'pressure_hPa', 'value': 1000.0, 'time': '2023-11-14T22:13:20.123000+00:00'})
+
+  def test_message_runs_are_exported_once_released(self):
+    first_seen = 1700000000000000000
+    for cycle in range(3):
+      self.storage.writereadings([Reading('System', 'error', error='Devices reported errors: GPS', time=first_seen + cycle * 60000000000)])
+      self.storage.end_cycle()
+
+    # The run is still being counted.
+    self.assertEqual(len(list(self.storage.exportndjson())), 1)
+
+    self.storage.end_cycle()
+    run = json.loads(list(self.storage.exportndjson())[1])
+    self.assertEqual(run['count'], 2)
+    self.assertEqual(run['first_seen'], '2023-11-14T22:14:20+00:00')
+    self.assertEqual(run['last_seen'], '2023-11-14T22:15:20+00:00')
+
+
+class ClockStepTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.storage = LocalSqlite(os.path.join(self.directory.name, 'data.db')).__enter__()
+
+  def tearDown(self):
+    self.storage.__exit__(None, None, None)
+    self.directory.cleanup()
+
+  def stored_times(self):
+    with self.storage.db_conn:
+      return [time_ns for time_ns, in self.storage.db_conn.execute("SELECT time_ns FROM data ORDER BY id")]
+
+  def test_reading_stamped_before_step_and_written_after_is_corrected(self):
+    # The cycle's time is taken, and a reading is stored, before the clock is set an hour ahead.
+    timesource = SyncTimeSource()
+    self.storage.check_clock()
+    timesource.set_time(datetime.datetime.now())
+    stamped = timesource.get_time_ns()
+    sensor = Sensor(None, self.storage, timesource)
+    sensor.name = 'Test'
+    sensor._try_write('Test', 'before', 1.0)
+
+    real_time = time.time
+    with mock.patch('time.time', lambda: real_time() + 3600):
+      # Written after the step, but with the time from before it.
+      sensor._try_write('Test', 'after', 2.0)
+
+    before, after = self.stored_times()
+    self.assertAlmostEqual(before, stamped + 3600 * 1000000000, delta=1000000000)
+    self.assertAlmostEqual(after, stamped + 3600 * 1000000000, delta=1000000000)
+
+
+if __name__ == '__main__':
+  unittest.main()
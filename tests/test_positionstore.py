@@ -0,0 +1,26 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from devices.positionstore import position_store_from_env
+
+
+class PositionStoreFromEnvTest(unittest.TestCase):
+  def test_path_defaults_to_next_to_database(self):
+    with tempfile.TemporaryDirectory() as directory:
+      with mock.patch.dict(os.environ, {'sqlite_db_path': os.path.join(directory, 'simpleaq.db')}):
+        os.environ.pop('position_path', None)
+        store = position_store_from_env()
+        store.update(47.6, -122.3)
+
+      self.assertEqual(store.path, os.path.join(directory, 'last_position.json'))
+      self.assertTrue(os.path.exists(store.path))
+
+  def test_position_path_is_used_when_set(self):
+    with mock.patch.dict(os.environ, {'position_path': '/data/position.json', 'sqlite_db_path': '/simpleaq/data/simpleaq.db'}):
+      self.assertEqual(position_store_from_env().path, '/data/position.json')
+
+
+if __name__ == '__main__':
+  unittest.main()
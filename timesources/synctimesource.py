@@ -1,16 +1,24 @@
 import datetime
 
-from . import TimeSource
+from . import TimeSource, clock_offset, datetime_to_ns
 
 class SyncTimeSource(TimeSource): 
   def __init__(self):
-    self.time = None
+    self.time_ns = None
+    self.clock_offset = None
 
   def set_time(self, time):
-    self.time = time
+    self.time_ns = datetime_to_ns(time)
+    self.clock_offset = clock_offset()
 
-  def get_time(self):
-    if self.time is None:
-      self.time = datetime.datetime.now()
+  def get_time_ns(self):
+    if self.time_ns is None:
+      self.set_time(datetime.datetime.now())
  
-    return self.time.astimezone().isoformat()
+    return self.time_ns
+
+  def get_clock_offset(self):
+    if self.clock_offset is None:
+      self.set_time(datetime.datetime.now())
+
+    return self.clock_offset
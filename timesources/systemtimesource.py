@@ -1,4 +1,4 @@
-import datetime
+import time
 
 from . import TimeSource
 
@@ -9,5 +9,5 @@ class SystemTimeSource(TimeSource):
   def set_time(self, time):
     pass
 
-  def get_time(self):
-    return datetime.datetime.now().astimezone().isoformat()
+  def get_time_ns(self):
+    return time.time_ns()
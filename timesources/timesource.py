@@ -1,5 +1,32 @@
 from abc import ABC, abstractmethod
+import datetime
+import functools
+import time as clock
 
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+# Nanoseconds since the epoch for a datetime.  Naive datetimes are taken to be local time.
+def datetime_to_ns(time):
+  return (time.astimezone() - EPOCH) // datetime.timedelta(microseconds=1) * 1000
+
+
+# The ISO 8601 string in local time that timestamps used to be, for the edges that need a string.
+# Readings from one cycle share a timestamp, so an upload formats only a few distinct times.
+@functools.lru_cache(maxsize=256)
+def format_time_ns(time_ns):
+  seconds, nanoseconds = divmod(time_ns, 1000000000)
+  return datetime.datetime.fromtimestamp(seconds).replace(microsecond=nanoseconds // 1000).astimezone().isoformat()
+
+
+# The wall clock minus the monotonic clock, in seconds.  It only changes when the wall clock is stepped,
+# so a timestamp taken with one offset and stored under another was taken before a step.
+def clock_offset():
+  return clock.time() - clock.monotonic()
+
+
+# Readings are timestamped in integer nanoseconds since the epoch, which are cheap to store,
+# compare and shift, and are what InfluxDB takes.  They are only formatted where a string is needed.
 class TimeSource(ABC): 
   def __init__(self):
     pass
@@ -9,5 +36,12 @@ class TimeSource(ABC):
     pass
 
   @abstractmethod
-  def get_time(self):
+  def get_time_ns(self):
     pass
+
+  # The clock_offset as of the time get_time_ns returns, so that storage can correct it for a later step.
+  def get_clock_offset(self):
+    return clock_offset()
+
+  def get_time(self):
+    return format_time_ns(self.get_time_ns())